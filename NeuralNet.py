@@ -1,9 +1,14 @@
 from datetime import datetime
 from random import uniform, randint, random
-from math import e
+from math import e, tanh
 import json
+import hashlib
 from os import path
-from copy import deepcopy
+from array import array
+from bisect import bisect_left
+from heapq import nlargest
+from itertools import accumulate
+import numpy as np
 from numpy.random import normal
 
 
@@ -14,29 +19,113 @@ def sigmoid(x):
     return final_val
 
 
-class Node:
+def sigmoid_array(x):
+    # Same as sigmoid(), applied element-wise to a numpy array
+    return 2 / (1 + np.exp(-4.9 * x)) - 1
 
-    def __init__(self):
-        self.input_sum = 0.0
-        self.output_value = 0.0
-        self.layer = 0
-        self.connections = []
 
-    def activate(self):
-        self.output_value = sigmoid(self.input_sum)
+def steep_tanh(x):
+    # The same curve as sigmoid(), 2 / (1 + e**(-2a * x)) - 1 = tanh(a * x), in one C call. Results differ from
+    # sigmoid() in the last bits, which is enough to change how games played by the brains go
+    return tanh(2.45 * x)
 
 
-class Connection:
+def steep_tanh_array(x):
+    return np.tanh(2.45 * x)
 
-    def __init__(self, from_node, to_node, weight, conn_num):
-        self.from_node = from_node
-        self.to_node = to_node
-        self.weight = weight
-        self.conn_num = conn_num
-        self.active = True
 
-    def __str__(self):
-        return "conn %d, from %d to %d weight %f" % (self.conn_num, self.from_node, self.to_node, self.weight)
+def to_little_endian_bytes(values, dtype):
+    # So that genome hashes are the same on every machine
+    return np.asarray(values, dtype=np.dtype(dtype).newbyteorder("<")).tobytes()
+
+
+class Activation:
+    # A node activation function: scalar() is used by Brain.feed_forward, vectorized() by BrainBatch on numpy arrays.
+    # The one in use is the module's activation, see set_activation()
+
+    def __init__(self, name, scalar, vectorized):
+        self.name = name
+        self.scalar = scalar
+        self.vectorized = vectorized
+
+
+class LookupActivation(Activation):
+    # Another activation precomputed at every step from -limit to limit, each value is looked up at the nearest table
+    # entry and clamped to the ends of the table outside of it. max_error is the largest difference from the exact
+    # activation, measured on a grid 16 times finer than the table and reaching 2 * limit past its ends
+
+    def __init__(self, exact, step=1 / 512, limit=3.0):
+        self.exact = exact
+        self.step = step
+        self.limit = limit
+        table_x = np.arange(int(round(2 * limit / step)) + 1) * step - limit
+        table = exact.vectorized(table_x)
+        scale = 1 / step
+        offset = limit / step + 0.5  # int() of this rounds to the nearest entry for all x above -limit - step / 2
+        last = len(table) - 1
+        values = table.tolist()
+
+        def scalar(x):
+            i = int(x * scale + offset)
+            return values[0 if i < 0 else last if i > last else i]
+
+        def vectorized(x):
+            return table.take(np.clip((x * scale + offset).astype(np.intp), 0, last))
+
+        Activation.__init__(self, "lookup", scalar, vectorized)
+
+        check_x = np.linspace(-3 * limit, 3 * limit, 16 * 3 * (len(table) - 1) + 1)
+        self.max_error = float(np.max(np.abs(vectorized(check_x) - exact.vectorized(check_x))))
+
+
+def lookup_activation(exact, max_error):
+    # The coarsest LookupActivation of exact that stays within max_error, for activations that level off towards -1 and
+    # 1 like sigmoid(): the table reaches as far as the activation is more than max_error / 2 away from them, and its
+    # step is small enough for the steepest part of the curve
+    limit = 0.5
+    while 1 - abs(exact.scalar(limit)) > max_error / 2 or 1 - abs(exact.scalar(-limit)) > max_error / 2:
+        limit *= 1.25
+    check_x = np.linspace(-limit, limit, 10001)
+    slope = float(np.max(np.abs(np.diff(exact.vectorized(check_x)) / np.diff(check_x))))
+    step = 2 * max_error / slope  # Half a step off the nearest entry is at most slope * step / 2 off
+    lookup = LookupActivation(exact, step, limit)
+    while lookup.max_error > max_error:
+        step /= 1.25
+        lookup = LookupActivation(exact, step, limit)
+    return lookup
+
+
+activations = {"sigmoid": Activation("sigmoid", sigmoid, sigmoid_array),
+               "tanh": Activation("tanh", steep_tanh, steep_tanh_array)}
+activation = activations["sigmoid"]
+
+
+def set_activation(new_activation):
+    # Brains look the activation up on every feed forward, so this applies to all of them from then on, in this
+    # process only
+    global activation
+    activation = new_activation
+
+
+def select_activation(name, max_error):
+    # set_activation() by name, max_error is that of the "lookup" activation of sigmoid(). Takes only picklable
+    # arguments, so that it can also be the initializer of worker processes, which have to build their own activation
+    if name == "lookup":
+        set_activation(lookup_activation(activations["sigmoid"], max_error))
+    else:
+        set_activation(activations[name])
+
+
+def reset_plan(state):
+    # Drops the compiled evaluation plan from a brain's attribute dict, compile() builds it again on first use. Every
+    # buffer of the plan is reset here, so that a fresh brain, a clone and a pickled brain are all without one
+    state["plan"] = None
+    state["plan_from"] = []
+    state["plan_to"] = []
+    state["plan_weight"] = []
+    state["node_values"] = []
+    state["input_sums"] = []
+    state["zero_sums"] = []
 
 
 class Brain:
@@ -46,7 +135,9 @@ class Brain:
     mutate_new_connection_prob = 0.08
     mutate_new_node_prob = 0.01
 
-    def __init__(self, input_nodes, output_nodes):
+    def __init__(self, input_nodes, output_nodes, genome=None):
+        # genome optionally is a (node_layer, conn_from, conn_to, conn_weight, conn_active) tuple of arrays to build
+        # the brain from, otherwise it starts with the input and output nodes and one random connection
         self.node_num = -1
         self.conn_number = 0
         self.input_nodes = input_nodes
@@ -55,21 +146,48 @@ class Brain:
         self.is_best = False
         self.hit_ball = False
         self.scored = False
-        self.all_nodes = []
-        self.all_connections = []
+        # The genome is stored column-wise: one layer per node and one from/to/weight/active entry per connection,
+        # a connection's conn_num is its index in these arrays
+        self.node_layer = array("i")
+        self.conn_from = array("i")
+        self.conn_to = array("i")
+        self.conn_weight = array("d")
+        self.conn_active = array("b")
+        self.shared_genome = False  # Set by clone(), the genome arrays are then shared with other brains
+        # Every (from, to) node pair a new connection could join: from's layer is below to's and the two aren't joined
+        # by an active connection yet. Built by build_candidates() on first use, then kept up to date by
+        # add_connection, add_node and the connection splitting in mutate
+        self.candidates = None
+        self.candidate_index = None  # (from, to) -> index in candidates
+        # layers[i] holds the numbers of the nodes in layer i in ascending order, the output nodes are in the last one.
+        # Built from node_layer once, then kept up to date by add_node. The lists of nodes are never changed in place,
+        # so clones only need a copy of the outer list
+        self.layers = None
+        self.shared_topology = False  # Set by clone(), candidates and layers are then shared with other brains
+        self.content_hash = None  # Cached genome_hash(), dropped whenever the genome changes
         # self.all_conn_str_list = []
 
+        # Compiled evaluation plan, built by compile() on first use and dropped whenever the genome changes
+        reset_plan(self.__dict__)
+
+        if genome is not None:
+            self.node_layer, self.conn_from, self.conn_to, self.conn_weight, self.conn_active = genome
+            self.node_num = len(self.node_layer) - 1
+            self.conn_number = len(self.conn_weight)
+            self.build_layers()
+            return
+
         for i in range(self.input_nodes):  # Create input nodes (own player's sticks, opponent's sticks, ball, ball_radius, player_thickness, player_width, player_height, player_max_hit_angle)
             self.add_node(autolayer=False)
-            self.all_nodes[self.node_num].layer = 0
+            self.node_layer[self.node_num] = 0
 
         # self.add_node(autolayer=False)  # Bias Node
-        # self.all_nodes[self.node_num].layer = 0
-        # self.all_nodes[self.node_num].output_value = 1
+        # self.node_layer[self.node_num] = 0
 
         for i in range(output_nodes):  # Create output nodes
             self.add_node(autolayer=False)
-            self.all_nodes[self.node_num].layer = 1
+            self.node_layer[self.node_num] = 1
+        self.build_layers()
 
         for i in range(1):
             self.new_rand_connection()
@@ -95,129 +213,449 @@ class Brain:
         # print(self.fitness)
 
     def put_input(self, input_data):
-        for node in self.all_nodes:
-            node.input_sum = 0.0
-        for i in range(len(input_data)):
-            self.all_nodes[i].output_value = input_data[i]
-
-    def get_outputs(self):
-        output_list = []
-        # for output_node in self.all_nodes[self.input_nodes + 1: self.input_nodes + 1 + self.output_nodes]:  # With bias node
-        #     output_list.append(output_node.output_value)
+        self.input_buffer()[:len(input_data)] = input_data
 
-        for output_node in self.all_nodes[self.input_nodes: self.input_nodes + self.output_nodes]:  # No bias node
-            output_list.append(output_node.output_value)
+    def input_buffer(self):
+        # The list feed_forward reads the inputs from, ready for the next call: the inputs go into its first
+        # input_nodes entries, and after feed_forward the outputs are in the output_nodes entries after them
+        if self.plan is None:
+            self.compile()
+        self.input_sums[:] = self.zero_sums
+        return self.node_values
 
-        return output_list
+    def get_outputs(self):
+        # return self.node_values[self.input_nodes + 1: self.input_nodes + 1 + self.output_nodes]  # With bias node
+        return self.node_values[self.input_nodes: self.input_nodes + self.output_nodes]  # No bias node
 
     def new_rand_connection(self):
-        from_node = randint(0, self.node_num)
-        to_node = randint(0, self.node_num)
-        conn_already_exists = False
-        for conn in self.all_nodes[from_node].connections:
-            conn_already_exists = conn_already_exists or self.all_connections[conn].to_node == to_node
-        while self.all_nodes[from_node].layer >= self.all_nodes[to_node].layer or conn_already_exists:
-            from_node = randint(0, self.node_num)
-            to_node = randint(0, self.node_num)
-            conn_already_exists = False
-            for conn in self.all_nodes[from_node].connections:
-                conn_already_exists = conn_already_exists or self.all_connections[conn].to_node == to_node
+        # Connects a uniformly chosen candidate pair, returns False if there is none left: the brain is fully connected
+        if self.candidates is None:
+            self.build_candidates()
+        if not self.candidates:
+            return False
+        from_node, to_node = self.candidates[randint(0, len(self.candidates) - 1)]
         self.add_connection(from_node, to_node, uniform(-1, 1))
+        return True
+
+    def build_candidates(self):
+        existing = set()
+        for conn_num in range(self.conn_number):
+            if self.conn_active[conn_num]:
+                existing.add((self.conn_from[conn_num], self.conn_to[conn_num]))
+
+        # Going down from the output layer, each node can connect to all nodes of the layers above it
+        self.own_topology()
+        self.candidates = []
+        above = []
+        for nodes in reversed(self.layers):
+            for from_node in nodes:
+                self.candidates.extend((from_node, to_node) for to_node in above if (from_node, to_node) not in existing)
+            above += nodes
+        self.candidate_index = {pair: i for i, pair in enumerate(self.candidates)}
+
+    def build_layers(self):
+        self.layers = [[] for i in range(max(self.node_layer) + 1)]
+        for node, layer in enumerate(self.node_layer):
+            self.layers[layer].append(node)
+        self.shared_topology = False
+
+    def output_layer(self):
+        return len(self.layers) - 1
+
+    def own_topology(self):
+        # Must be called before any change to the candidates or the layers
+        if self.shared_topology:
+            if self.candidates is not None:
+                self.candidates = list(self.candidates)
+                self.candidate_index = dict(self.candidate_index)
+            self.layers = list(self.layers)
+            self.shared_topology = False
+
+    def add_candidate(self, pair):
+        if self.candidates is not None and pair not in self.candidate_index:
+            self.own_topology()
+            self.candidate_index[pair] = len(self.candidates)
+            self.candidates.append(pair)
+
+    def remove_candidate(self, pair):
+        # Swap with the last candidate and pop, so removal doesn't shift the whole list
+        if self.candidates is not None and pair in self.candidate_index:
+            self.own_topology()
+            i = self.candidate_index.pop(pair)
+            last = self.candidates.pop()
+            if i < len(self.candidates):
+                self.candidates[i] = last
+                self.candidate_index[last] = i
+
+    def clone(self):
+        # Cheap copy for offspring: the new brain shares this brain's genome arrays until one of the two changes
+        # them, at which point copy_on_write() gives it a copy of its own. Built from the attribute dict rather than
+        # with copy(), which would go through __getstate__ and lose the candidates the two share as well
+        child = object.__new__(Brain)
+        child.__dict__.update(self.__dict__)
+        child.fitness = 0
+        child.is_best = False
+        child.hit_ball = False
+        child.scored = False
+        reset_plan(child.__dict__)  # The child compiles its own plan, it must not keep the parent's lists alive
+        child.shared_genome = True
+        self.shared_genome = True
+        child.shared_topology = True
+        self.shared_topology = True
+        return child
+
+    def __getstate__(self):
+        # Brains are pickled to be sent to the worker processes that play the games. Only the genome and the layers
+        # go along, the candidates and the compiled plan are rebuilt there on first use if they are needed at all.
+        # clone() doesn't come through here, its children keep sharing the candidates
+        state = self.__dict__.copy()
+        state["candidates"] = None
+        state["candidate_index"] = None
+        reset_plan(state)
+        return state
+
+    def copy_on_write(self):
+        # Must be called before any change to the genome
+        if self.shared_genome:
+            self.node_layer = array("i", self.node_layer)
+            self.conn_from = array("i", self.conn_from)
+            self.conn_to = array("i", self.conn_to)
+            self.conn_weight = array("d", self.conn_weight)
+            self.conn_active = array("b", self.conn_active)
+            self.shared_genome = False
+        self.plan = None
+        self.content_hash = None
 
     def add_node(self, autolayer=True, from_layer=0, to_layer=0):
-        new_node = Node()
+        # Without a free layer between from_layer and to_layer, a new layer is inserted above from_layer: only the
+        # nodes of the layers above move up, found through layers instead of checking every node
+        self.copy_on_write()
+        layer = 0
         if autolayer:
+            layer = from_layer + 1
             if to_layer - from_layer <= 1:
-                for out_node in self.all_nodes:
-                    if out_node.layer > from_layer:
-                        out_node.layer += 1
-            new_node.layer = from_layer + 1
-        self.all_nodes.append(new_node)
+                self.own_topology()
+                node_layer = self.node_layer
+                for nodes in self.layers[layer:]:
+                    for node in nodes:
+                        node_layer[node] += 1
+                self.layers.insert(layer, [])
+        self.node_layer.append(layer)
         self.node_num += 1
+        if self.layers is not None:  # The constructor builds layers once all input and output nodes are there
+            self.own_topology()
+            self.layers[layer] = self.layers[layer] + [self.node_num]
+
+        # Shifting layers up keeps every other pair in the same order, only the new node's pairs are candidates
+        if self.candidates is not None:
+            for nodes in self.layers[:layer]:
+                for node in nodes:
+                    self.add_candidate((node, self.node_num))
+            for nodes in self.layers[layer + 1:]:
+                for node in nodes:
+                    self.add_candidate((self.node_num, node))
 
     def add_connection(self, orig, dest, wght):
-        new_connection = Connection(orig, dest, wght, self.conn_number)
-        self.all_connections.append(new_connection)
-        self.all_nodes[orig].connections.append(self.conn_number)
-        # print(str(new_connection))
-        # for new_connection in self.all_connections:
-            # self.all_conn_str_list.append(str(new_connection))
+        self.copy_on_write()
+        self.conn_from.append(orig)
+        self.conn_to.append(dest)
+        self.conn_weight.append(wght)
+        self.conn_active.append(True)
+        self.remove_candidate((orig, dest))
+        # for conn_num in range(self.conn_number):
+            # print("conn %d, from %d to %d weight %f" % (conn_num, self.conn_from[conn_num], self.conn_to[conn_num], self.conn_weight[conn_num]))
         self.conn_number += 1
 
-    def feed_forward(self):
-
-        output_layer = self.all_nodes[self.input_nodes + 2].layer
-
-        # print(self.all_conn_str_list)
-
-        layers = []
-        for i in range(output_layer + 1):
-            layers.append([])
-        for i in range(len(self.all_nodes)):
-            layers[self.all_nodes[i].layer].append(i)
+    def genome_hash(self):
+        # Hex digest of everything feed_forward depends on: the layer of every node and the from, to and weight of the
+        # active connections in their order, which also fixes the order the inputs of a node are summed in. Brains
+        # with the same hash give exactly the same outputs, however they came about
+        if self.content_hash is None:
+            active = np.frombuffer(self.conn_active, np.int8).astype(bool)
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(to_little_endian_bytes(self.node_layer, np.int32))
+            digest.update(to_little_endian_bytes(np.frombuffer(self.conn_from, np.intc)[active], np.int32))
+            digest.update(to_little_endian_bytes(np.frombuffer(self.conn_to, np.intc)[active], np.int32))
+            digest.update(to_little_endian_bytes(np.frombuffer(self.conn_weight, np.float64)[active], np.float64))
+            self.content_hash = digest.hexdigest()
+        return self.content_hash
+
+    def get_node_connections(self):
+        # Active outgoing connection numbers of every node, in the order they were added
+        node_connections = [[] for node_layer in self.node_layer]
+        for conn_num in range(self.conn_number):
+            if self.conn_active[conn_num]:
+                node_connections[self.conn_from[conn_num]].append(conn_num)
+        return node_connections
+
+    def compile(self):
+        # Flatten the topology into parallel from/to/weight lists ordered by source layer, so that feed_forward only
+        # has to walk flat lists instead of regrouping all nodes into layers on every call
+
+        output_layer = self.output_layer()
+        layers = self.layers
+        node_connections = self.get_node_connections()
+
+        self.plan = []
+        self.plan_from = []
+        self.plan_to = []
+        self.plan_weight = []
+        for layer_num in range(output_layer):  # Output nodes are never fed forward
+            hidden_nodes = []
+            start = len(self.plan_from)
+            for node_index in layers[layer_num]:
+                if layer_num != 0:  # Don't activate input nodes
+                    hidden_nodes.append(node_index)
+                for conn_num in node_connections[node_index]:
+                    self.plan_from.append(self.conn_from[conn_num])
+                    self.plan_to.append(self.conn_to[conn_num])
+                    self.plan_weight.append(self.conn_weight[conn_num])
+            self.plan.append((hidden_nodes, start, len(self.plan_from)))
+
+        self.node_values = [0.0] * len(self.node_layer)
+        self.input_sums = [0.0] * len(self.node_layer)
+        self.zero_sums = [0.0] * len(self.node_layer)
 
-        for layer in layers[:output_layer]:
-            for node_index in layer:
-                node = self.all_nodes[node_index]
+    def feed_forward(self):
+        if self.plan is None:
+            self.compile()
 
-                if node.layer is not 0 and node.layer is not output_layer:  # Don't call activate on input and output nodes
-                    node.activate()
+        node_values = self.node_values
+        input_sums = self.input_sums
+        plan_from = self.plan_from
+        plan_to = self.plan_to
+        plan_weight = self.plan_weight
+        activate = activation.scalar
 
-                if node.layer is not output_layer:  # Do not feedforward output nodes
-                    # print(node.layer, node.output_value)
-                    for conn_num in node.connections:
-                        # print(len(self.all_connections), conn_num)
-                        connection = self.all_connections[conn_num]
-                        self.all_nodes[connection.to_node].input_sum += node.output_value * connection.weight
+        for hidden_nodes, start, end in self.plan:
+            for node_index in hidden_nodes:  # Activate hidden nodes of this layer before feeding them forward
+                node_values[node_index] = activate(input_sums[node_index])
+            for i in range(start, end):
+                input_sums[plan_to[i]] += node_values[plan_from[i]] * plan_weight[i]
 
-        for node in self.all_nodes[self.input_nodes:self.input_nodes + self.output_nodes]:  # Finally activate output nodes
-            node.activate()
-            # print(node.layer, node.input_sum)
+        for node_index in range(self.input_nodes, self.input_nodes + self.output_nodes):  # Finally activate output nodes
+            node_values[node_index] = activate(input_sums[node_index])
 
     def mutate(self):
 
-        for connection_num in range(0, len(self.all_connections)):
-            connection = self.all_connections[connection_num]
-            if connection.active:
+        for connection_num in range(0, self.conn_number):
+            if self.conn_active[connection_num]:
                 if random() <= Brain.mutate_change_weight_prob:
+                    self.copy_on_write()
                     if random() <= Brain.mutate_new_rand_weight_prob:
-                        connection.weight = uniform(-1, 1)
+                        self.conn_weight[connection_num] = uniform(-1, 1)
                     else:
-                        connection.weight += normal() / 50
-                        if connection.weight > 1:
-                            connection.weight = 1
-                        elif connection.weight < -1:
-                            connection.weight = -1
+                        weight = self.conn_weight[connection_num] + normal() / 50
+                        if weight > 1:
+                            weight = 1
+                        elif weight < -1:
+                            weight = -1
+                        self.conn_weight[connection_num] = weight
 
         if random() <= Brain.mutate_new_connection_prob:
             self.new_rand_connection()
 
         if random() <= Brain.mutate_new_node_prob:
-            rand_conn_i = randint(0, len(self.all_connections) - 1)
-            while not self.all_connections[rand_conn_i].active:
-                rand_conn_i = randint(0, len(self.all_connections) - 1)
-            connection = self.all_connections[rand_conn_i]
-            from_node = connection.from_node
-            to_node = connection.to_node
-            self.all_nodes[from_node].connections.remove(connection.conn_num)
-            connection.active = False
-            self.add_node(from_layer=self.all_nodes[from_node].layer,
-                          to_layer=self.all_nodes[to_node].layer)
+            rand_conn_i = randint(0, self.conn_number - 1)
+            while not self.conn_active[rand_conn_i]:
+                rand_conn_i = randint(0, self.conn_number - 1)
+            self.copy_on_write()
+            from_node = self.conn_from[rand_conn_i]
+            to_node = self.conn_to[rand_conn_i]
+            self.conn_active[rand_conn_i] = False
+            self.add_candidate((from_node, to_node))
+            self.add_node(from_layer=self.node_layer[from_node],
+                          to_layer=self.node_layer[to_node])
             self.add_connection(from_node, self.node_num, uniform(-1, 1))
             self.add_connection(self.node_num, to_node, uniform(-1, 1))
 
 
+class BrainBatch:
+    # Evaluates a whole list of brains for one frame in a single vectorized call. Every brain's compiled plan is packed
+    # into one big node array (brain i owns a contiguous block of it) and, per layer, into flat source/target/weight
+    # arrays whose weighted contributions are segment-summed with np.bincount
+
+    def __init__(self, brains):
+        self.brains = brains
+        self.input_nodes = brains[0].input_nodes
+        self.output_nodes = brains[0].output_nodes
+
+        offsets = []
+        node_count = 0
+        for brain in brains:
+            if brain.input_nodes != self.input_nodes or brain.output_nodes != self.output_nodes:
+                raise ValueError("All brains in a batch need the same number of input and output nodes")
+            if brain.plan is None:
+                brain.compile()
+            offsets.append(node_count)
+            node_count += len(brain.node_values)
+        self.node_count = node_count
+
+        offsets = np.array(offsets)
+        self.input_index = offsets[:, None] + np.arange(self.input_nodes)
+        self.output_index = offsets[:, None] + np.arange(self.input_nodes, self.input_nodes + self.output_nodes)
+
+        # Group hidden nodes and connections of all brains by the layer they are fed forward from
+        steps = []
+        for brain, offset in zip(brains, offsets):
+            for layer_num, (hidden_nodes, start, end) in enumerate(brain.plan):
+                if layer_num == len(steps):
+                    steps.append(([], [], [], []))
+                hidden, conn_from, conn_to, conn_weight = steps[layer_num]
+                hidden.extend(offset + node_index for node_index in hidden_nodes)
+                conn_from.extend(offset + node_index for node_index in brain.plan_from[start:end])
+                conn_to.extend(offset + node_index for node_index in brain.plan_to[start:end])
+                conn_weight.extend(brain.plan_weight[start:end])
+
+        self.steps = []
+        for hidden, conn_from, conn_to, conn_weight in steps:
+            self.steps.append((np.array(hidden, dtype=np.intp), np.array(conn_from, dtype=np.intp),
+                               np.array(conn_to, dtype=np.intp), np.array(conn_weight, dtype=float)))
+
+        self.node_values = np.zeros(node_count)
+        self.input_sums = np.zeros(node_count)
+
+    def feed_forward(self, observations, out=None):
+        # observations is a (brains x input_nodes) array, returns the (brains x output_nodes) array of outputs, written
+        # into out if given
+        node_values = self.node_values
+        input_sums = self.input_sums
+        input_sums.fill(0.0)
+        node_values[self.input_index] = observations
+
+        for hidden, conn_from, conn_to, conn_weight in self.steps:
+            if len(hidden):
+                node_values[hidden] = activation.vectorized(input_sums[hidden])
+            if len(conn_from):
+                input_sums += np.bincount(conn_to, weights=node_values[conn_from] * conn_weight, minlength=self.node_count)
+
+        outputs = activation.vectorized(input_sums[self.output_index])
+        if out is None:
+            return outputs
+        out[...] = outputs
+        return out
+
+
+binary_extension = ".ckpt"  # Populations with this file extension are saved in the binary format of checkpoint.py
+log_extension = ".ckptlog"  # and these are appended to a checkpoint log of every generation, see checkpoint.py
+
+
+class JSONStream:
+    # Decodes a JSON document value by value from a file that is read in chunks, so that only the part of the document
+    # that hasn't been decoded yet is held as text, never the whole file
+
+    chunk_size = 1 << 16
+    whitespace = " \t\n\r"
+
+    def __init__(self, fin):
+        self.fin = fin
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        # Drops what was decoded and appends the next chunk, returns False at the end of the file
+        chunk = self.fin.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # The next character that isn't whitespace
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                raise json.JSONDecodeError("Unexpected end of file", self.buffer, self.pos)
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError("Expecting %r" % char, self.buffer, self.pos)
+        self.pos += 1
+
+    def skip(self, char):
+        # Skips char if it comes next, returns whether it did
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        # A whole value, reading chunks until it is complete. A value that ends right at the end of the buffer might be
+        # a number that goes on in the next chunk
+        self.peek()
+        while True:
+            try:
+                value, end = json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            if end == len(self.buffer) and self.read_more():
+                continue
+            self.pos = end
+            return value
+
+
+json_decoder = json.JSONDecoder()
+
+
+def brain_from_dict(net):
+    # The per node connection lists in the file are redundant, they are rebuilt from the connections
+    connections = net["connections"]
+    genome = (array("i", [node["layer"] for node in net["nodes"]]),
+              array("i", [connection["from"] for connection in connections]),
+              array("i", [connection["to"] for connection in connections]),
+              array("d", [connection["weight"] for connection in connections]),
+              array("b", [connection["active"] != "False" for connection in connections]))
+    return Brain(36, 8, genome)
+
+
+def read_json_population(fin):
+    # Returns (gen, brains) of a population file written by Population.save_to_file. The nets are decoded one at a
+    # time and turned into brains right away, so next to the brains only one decoded net and a chunk of text are held
+    gen = 1
+    brains = []
+    stream = JSONStream(fin)
+    stream.expect("{")
+    while not stream.skip("}"):
+        key = stream.value()
+        stream.expect(":")
+        if key == "nets":
+            stream.expect("[")
+            while not stream.skip("]"):
+                brains.append(brain_from_dict(stream.value()))
+                stream.skip(",")
+        elif key == "gen":
+            gen = stream.value()
+        else:
+            stream.value()
+        stream.skip(",")
+    return gen, brains
+
+
 class Population:
 
-    size = 300
+    default_size = 300
+    default_elites = 2
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, size=None, elites=None):
+        # size is the number of nets every new generation gets, by default it is the number of nets in the file.
+        # elites is the number of best nets that are carried over into the next generation unchanged
         self.all_nets = []
         self.gen = 1
         self.best_fitness = 1
-        self.max_fit_index = 0
-        self.max_fit_index2 = 0
+        self.elites = elites if elites is not None else Population.default_elites
+        self.elite_indices = []  # Indices of the elites in all_nets, best first
         self.fitness_sum = 0
+        self.cumulative_fitness = []  # cumulative_fitness[i] is the fitness sum of all_nets[0] to all_nets[i]
+        self.parents = None  # parents[i] is the index of all_nets[i]'s parent in the previous generation
+        self.log = None
 
         if filename is None:
             date = datetime.now()
@@ -225,112 +663,87 @@ class Population:
         else:
             self.filename = filename
 
-        if path.isfile(self.filename):
+        if path.isfile(self.filename) and self.filename.endswith(binary_extension):
+            from checkpoint import read_checkpoint  # checkpoint imports this module, so it can't be imported on top
+            self.gen, self.all_nets = read_checkpoint(self.filename)
+
+        elif path.isfile(self.filename) and self.filename.endswith(log_extension):
+            from checkpoint import CheckpointLog
+            self.log = CheckpointLog(self.filename)
+            self.gen, self.all_nets = self.log.read_generation()
+
+        elif path.isfile(self.filename):
             with open(self.filename, "r") as fin:
-                population_dict = json.load(fin)
-
-                self.gen = population_dict["gen"]
-                nets = deepcopy(population_dict["nets"])
-                for net in nets:
-                    import_net = Brain(36, 8)
-                    import_nodes = []
-                    import_net.node_num = net["node_num"]
-                    import_net.conn_number = net["conn_number"]
-                    for node in net["nodes"]:
-                        import_node = Node()
-                        import_node.layer = node["layer"]
-                        import_node.connections = node["connections"]
-                        import_nodes.append(import_node)
-                    import_connections = []
-                    for connection in net["connections"]:
-                        import_connection = Connection(connection["from"], connection["to"], connection["weight"], connection["conn_num"])
-                        if connection["active"] == "False":
-                            import_connection.active = False
-                        import_connections.append(import_connection)
-                    import_net.all_connections = deepcopy(import_connections)
-                    import_net.all_nodes = deepcopy(import_nodes)
-                    self.all_nets.append(import_net)
+                self.gen, self.all_nets = read_json_population(fin)
 
         else:
-            for i in range(Population.size):
+            for i in range(size if size is not None else Population.default_size):
                 self.all_nets.append(Brain(36, 8))
 
+        self.size = size if size is not None else len(self.all_nets)
+
     def set_best_player(self):
-        max_fit = 0
-        max_fit2 = 0
-        self.max_fit_index = 0
-        self.max_fit_index2 = 0
-        for i in range(0, self.size):
-            if self.all_nets[i].fitness > max_fit:
-                max_fit = self.all_nets[i].fitness
-                self.max_fit_index = i
-
-        for i in range(0, self.size):
-            if self.all_nets[i].fitness > max_fit2 and self.all_nets[i].fitness != max_fit:
-                max_fit2 = self.all_nets[i].fitness
-                self.max_fit_index2 = i
-
-        self.best_fitness = max_fit
-        self.all_nets[self.max_fit_index].is_best = True
-        self.all_nets[self.max_fit_index2].is_best = True
+        # One pass with a heap of the best nets seen so far, equally fit nets are ranked by index
+        all_nets = self.all_nets
+        best = nlargest(max(self.elites, 1), range(len(all_nets)), key=lambda i: all_nets[i].fitness)
+
+        self.best_fitness = all_nets[best[0]].fitness
+        self.elite_indices = best[:self.elites]
+        for i in self.elite_indices:
+            all_nets[i].is_best = True
 
     def generate_offspring(self):
         new_nets = []
         self.gen += 1
-        for i in range(Population.size):
-            new_nets.append(Brain(36, 8))
-
-        new_nets[0].all_nodes = deepcopy(self.all_nets[self.max_fit_index].all_nodes)
-        new_nets[0].all_connections = deepcopy(self.all_nets[self.max_fit_index].all_connections)
-        new_nets[0].node_num = self.all_nets[self.max_fit_index].node_num
-        new_nets[0].conn_number = self.all_nets[self.max_fit_index].conn_number
-        # new_nets[0].all_conn_str_list = self.all_nets[self.max_fit_index].all_conn_str_list
-        new_nets[0].is_best = True
-
-        new_nets[1].all_nodes = deepcopy(self.all_nets[self.max_fit_index2].all_nodes)
-        new_nets[1].all_connections = deepcopy(self.all_nets[self.max_fit_index2].all_connections)
-        new_nets[1].node_num = self.all_nets[self.max_fit_index2].node_num
-        new_nets[1].conn_number = self.all_nets[self.max_fit_index2].conn_number
-        # new_nets[1].all_conn_str_list = self.all_nets[self.max_fit_index].all_conn_str_list
-        new_nets[1].is_best = True
 
-        self.fitness_sum = 0
-        for net in self.all_nets:
-            self.fitness_sum += net.fitness
+        self.parents = self.elite_indices[:self.size]
+        for parent in self.parents:
+            new_nets.append(self.all_nets[parent].clone())
+            new_nets[-1].is_best = True
+        elite_count = len(new_nets)
 
-        for i in range(2, Population.size):
+        # Built once per generation, so that select_parent can binary search it instead of summing up to the parent
+        self.cumulative_fitness = list(accumulate(net.fitness for net in self.all_nets))
+        self.fitness_sum = self.cumulative_fitness[-1]
+
+        for i in range(len(new_nets), self.size):
             parent = self.select_parent()
-            new_nets[i].all_nodes = deepcopy(self.all_nets[parent].all_nodes)
-            new_nets[i].all_connections = deepcopy(self.all_nets[parent].all_connections)
-            new_nets[i].node_num = self.all_nets[parent].node_num
-            new_nets[i].conn_number = self.all_nets[parent].conn_number
-            new_nets[i].is_best = False
-            # new_nets[i].all_conn_str_list = self.all_nets[parent].all_conn_str_list
+            new_nets.append(self.all_nets[parent].clone())
+            self.parents.append(parent)
 
-        self.all_nets = deepcopy(new_nets)
+        self.all_nets = new_nets
 
-        for i in range(2 % len(self.all_nets), len(self.all_nets)):
+        for i in range(elite_count, len(self.all_nets)):
             self.all_nets[i].mutate()
 
     def select_parent(self):
+        # First net whose cumulative fitness reaches rand, fitness is never negative so the table is sorted
         rand = uniform(0, self.fitness_sum)
-        running_sum = 0
-        for i in range(0, len(self.all_nets)):
-            running_sum += self.all_nets[i].fitness
-            if running_sum >= rand:
-                return i
+        return bisect_left(self.cumulative_fitness, rand)
 
     def save_to_file(self):
+        if self.filename.endswith(binary_extension):
+            from checkpoint import write_checkpoint
+            write_checkpoint(self.filename, self.gen, self.all_nets)
+            return
+
+        if self.filename.endswith(log_extension):
+            if self.log is None:
+                from checkpoint import CheckpointLog
+                self.log = CheckpointLog(self.filename)
+            self.log.append(self.gen, self.all_nets, self.parents)
+            return
+
         net_count = 0
         population_dict = {"gen": self.gen, "nets": []}
         for net in self.all_nets:
-            output_layer = net.all_nodes[43].layer
+            output_layer = net.output_layer()
             nodes = []
-            for node in net.all_nodes:
-                nodes.append({"layer": node.layer, "connections": node.connections})
+            for layer, connections in zip(net.node_layer, net.get_node_connections()):
+                nodes.append({"layer": layer, "connections": connections})
             connections = []
-            for connection in net.all_connections:
-                connections.append({"from": connection.from_node, "to": connection.to_node, "weight": connection.weight, "conn_num": connection.conn_num, "active": str(connection.active)})
+            for conn_num in range(net.conn_number):
+                connections.append({"from": net.conn_from[conn_num], "to": net.conn_to[conn_num], "weight": net.conn_weight[conn_num], "conn_num": conn_num, "active": str(bool(net.conn_active[conn_num]))})
             final_net_dict = {"last_layer": output_layer,"node_num": net.node_num, "conn_number": net.conn_number, "nodes": nodes, "connections": connections}
             population_dict["nets"].append(final_net_dict)
             net_count += 1
@@ -0,0 +1,288 @@
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+from os import path
+from random import Random, seed
+from time import perf_counter
+import numpy as np
+from NeuralNet import Population
+from game import game_seeds, make_games, run_all_games_headless, update_all_brains
+
+# Reproducible benchmarks of the simulation and evolution hot paths, run on the checked-in populations with fixed
+# seeds. Results are written as JSON, so runs on different commits can be compared:
+#   python benchmark.py --output before.json
+#   python benchmark.py test_pop_10.json --frames 200 --repeat 5
+
+default_populations = [path.join(path.dirname(path.abspath(__file__)), filename) for filename in
+                       ("test_pop_04.json", "test_pop_06.json", "test_pop_07.json", "test_pop_08.json",
+                        "test_pop_09.json", "test_pop_10.json", "pycharm_test_pop.json")]
+
+
+def best_of(repeat, function):
+    # Smallest of repeat timings of function(), the least disturbed by whatever else runs on the machine
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def active_connections(brain):
+    return sum(brain.conn_active)
+
+
+def bench_feed_forward(population, calls, repeat, run_seed):
+    # Time per put_input + feed_forward call of every net, summarised per quarter of the population by genome size
+    rand = Random(run_seed)
+    input_nodes = population.all_nets[0].input_nodes
+    inputs = [[rand.uniform(-1, 1) for i in range(input_nodes)] for j in range(calls)]
+
+    timings = []
+    for brain in population.all_nets:
+        brain.put_input(inputs[0])  # Compiles the plan outside of the timing
+        brain.feed_forward()
+
+        def run():
+            for observation in inputs:
+                brain.put_input(observation)
+                brain.feed_forward()
+        timings.append((active_connections(brain), best_of(repeat, run) / calls))
+
+    timings.sort()
+    quarters = []
+    for i in range(4):
+        quarter = timings[i * len(timings) // 4:(i + 1) * len(timings) // 4]
+        if quarter:
+            quarters.append({"active_connections": [quarter[0][0], quarter[-1][0]],
+                             "us_per_call": 1e6 * sum(timing for connections, timing in quarter) / len(quarter)})
+    return {"us_per_call": 1e6 * sum(timing for connections, timing in timings) / len(timings),
+            "by_genome_size": quarters}
+
+
+def bench_games(population, game_count, frames, run_seed):
+    # Plays the first games of a generation for a fixed number of frames, timing Game.update_all (physics, collisions
+    # and scoring) apart from the brains. A second identical run times every Ball.check_collision call
+    brain_pairs = [(population.all_nets[i], population.all_nets[i + 1]) for i in range(0, 2 * game_count, 2)]
+    seeds = game_seeds(run_seed, population.gen, len(brain_pairs))
+
+    games = make_games(brain_pairs, seeds)
+    brain_time = 0
+    update_time = 0
+    game_frames = 0
+    for frame in range(frames):
+        start = perf_counter()
+        update_all_brains(games)
+        brain_time += perf_counter() - start
+        start = perf_counter()
+        for game in games:
+            game.update_all()
+        update_time += perf_counter() - start
+        game_frames += sum(not game.game_over for game in games)
+
+    games = make_games(brain_pairs, seeds)
+    collision = {"time": 0, "calls": 0}
+    for game in games:
+        game.ball.check_collision = timed(game.ball.check_collision, collision)
+    for frame in range(frames):
+        update_all_brains(games)
+        for game in games:
+            game.update_all()
+
+    return {"games": len(games), "game_frames": game_frames,
+            "update_all_frames_per_s": game_frames / update_time,
+            "brains_frames_per_s": game_frames / brain_time,
+            "frames_per_s": game_frames / (brain_time + update_time),
+            "check_collision_us_per_call": 1e6 * collision["time"] / max(collision["calls"], 1)}
+
+
+def timed(function, totals):
+    def wrapper():
+        start = perf_counter()
+        function()
+        totals["time"] += perf_counter() - start
+        totals["calls"] += 1
+    return wrapper
+
+
+def bench_fast_forward(population, game_count, action_repeat, run_seed):
+    # Whole games played headless with and without --fast-forward, then once more replaying every skip frame by frame
+    # from the state before it: a skip must not pass over a collision, must leave every stick exactly where stepping
+    # does, and the ball up to a fraction of a pixel. Anything else fails the benchmark
+    brain_pairs = [(population.all_nets[i], population.all_nets[i + 1]) for i in range(0, 2 * game_count, 2)]
+    seeds = game_seeds(run_seed, population.gen, len(brain_pairs))
+
+    results = {"action_repeat": action_repeat}
+    for fast_forward in (False, True):
+        games = make_games(brain_pairs, seeds)
+        start = perf_counter()
+        frames = run_all_games_headless(games, action_repeat=action_repeat, fast_forward=fast_forward)
+        results["fast_forward" if fast_forward else "stepped"] = {"frames": frames,
+                                                                   "frames_per_s": frames / (perf_counter() - start)}
+
+    games = make_games(brain_pairs, seeds)
+    check = {"skips": 0, "skipped_frames": 0, "missed_collisions": 0, "stick_mismatches": 0, "max_ball_error": 0.0}
+    for game in games:
+        game.fast_forward = checked_fast_forward(game, check)
+    run_all_games_headless(games, action_repeat=action_repeat, fast_forward=True)
+    if check["missed_collisions"] or check["stick_mismatches"] or check["max_ball_error"] > 1e-3:
+        raise RuntimeError("--fast-forward doesn't replay stepped play: %s" % check)
+    results["check"] = check
+    return results
+
+
+def checked_fast_forward(game, check):
+    sticks = [stick for opponent in game.opponents for stick in opponent.sticks]
+    fast_forward = game.fast_forward
+
+    def state():
+        return ((game.ball.pos_x, game.ball.pos_y, game.ball.vel_x, game.ball.vel_y),
+                [(stick.lin_pos, stick.lin_vel, stick.rot_pos, stick.rot_vel) for stick in sticks])
+
+    def restore(saved):
+        game.ball.pos_x, game.ball.pos_y, game.ball.vel_x, game.ball.vel_y = saved[0]
+        for stick, stick_state in zip(sticks, saved[1]):
+            stick.lin_pos, stick.lin_vel, stick.rot_pos, stick.rot_vel = stick_state
+
+    def wrapper(limit):
+        before = state()
+        frames = fast_forward(limit)
+        if frames == 0:
+            return 0
+        skipped = state()
+
+        restore(before)
+        for frame in range(frames):
+            for opponent in game.opponents:
+                opponent.update()
+            game.ball.update()
+            ball = (game.ball.pos_x, game.ball.pos_y, game.ball.vel_x, game.ball.vel_y)
+            game.ball.check_collision()
+            if ball != (game.ball.pos_x, game.ball.pos_y, game.ball.vel_x, game.ball.vel_y):
+                check["missed_collisions"] += 1
+                break
+        stepped = state()
+
+        check["skips"] += 1
+        check["skipped_frames"] += frames
+        check["max_ball_error"] = max(check["max_ball_error"], abs(stepped[0][0] - skipped[0][0]),
+                                      abs(stepped[0][1] - skipped[0][1]))
+        if stepped[1] != skipped[1]:
+            check["stick_mismatches"] += 1
+        restore(skipped)  # Carry on from the skip, as an unchecked run would
+        return frames
+    return wrapper
+
+
+def bench_offspring(population, repeat, run_seed):
+    # set_best_player and generate_offspring from the same seeded fitness values every time. Offspring are clones,
+    # so the loaded generation is left untouched and can be restored for the next repetition
+    nets = population.all_nets
+    gen = population.gen
+
+    def run():
+        population.all_nets = list(nets)
+        population.gen = gen
+        seed(run_seed)
+        np.random.seed(run_seed)
+        rand = Random(run_seed)
+        for net in population.all_nets:
+            net.fitness = rand.uniform(0, 3)
+        start = perf_counter()
+        population.set_best_player()
+        population.generate_offspring()
+        timings.append(perf_counter() - start)
+
+    timings = []
+    for i in range(repeat):
+        run()
+    population.all_nets = nets
+    population.gen = gen
+    return {"ms": 1e3 * min(timings)}
+
+
+def bench_files(population, repeat, run_seed, directory):
+    # Save and load in every population format, plus appending one delta generation to a checkpoint log
+    results = {}
+    nets = population.all_nets
+    gen = population.gen
+    for extension in (".json", ".ckpt"):
+        population.filename = path.join(directory, "population" + extension)
+        results[extension] = {"save_ms": 1e3 * best_of(repeat, population.save_to_file),
+                              "load_ms": 1e3 * best_of(repeat, lambda: Population(population.filename)),
+                              "bytes": path.getsize(population.filename)}
+
+    append_times = []
+    for i in range(repeat):
+        population.filename = path.join(directory, "population%d.ckptlog" % i)
+        population.log = None
+        population.parents = None
+        population.save_to_file()
+        seed(run_seed)
+        np.random.seed(run_seed)
+        population.set_best_player()  # Fitness values are left over from bench_offspring
+        population.generate_offspring()
+        start = perf_counter()
+        population.save_to_file()
+        append_times.append(perf_counter() - start)
+        population.all_nets = nets
+        population.gen = gen
+    results[".ckptlog"] = {"delta_append_ms": 1e3 * min(append_times),
+                           "delta_bytes": population.log.records[-1][4]}
+    population.log = None
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=path.dirname(path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation and evolution hot paths")
+    parser.add_argument("populations", nargs="*", default=default_populations, help="population files to benchmark on (default: the checked-in ones)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for inputs, kick-offs and mutations (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="timings are the best of this many runs (default: %(default)s)")
+    parser.add_argument("--calls", type=int, default=50, help="feed_forward calls per net (default: %(default)s)")
+    parser.add_argument("--games", type=int, default=20, help="games played per population (default: %(default)s)")
+    parser.add_argument("--frames", type=int, default=500, help="frames played per game (default: %(default)s)")
+    parser.add_argument("--action-repeat", type=int, default=16, help="decision interval of the --fast-forward games (default: %(default)s)")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to (default: print them)")
+    args = parser.parse_args()
+
+    results = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+               "settings": {"seed": args.seed, "repeat": args.repeat, "calls": args.calls, "games": args.games,
+                            "frames": args.frames, "action_repeat": args.action_repeat},
+               "populations": {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for filename in args.populations:
+            population = Population(filename)
+            population.filename = path.join(directory, "unused.json")  # Never write back to the checked-in file
+            results["populations"][path.basename(filename)] = {
+                "nets": len(population.all_nets),
+                "mean_active_connections": sum(active_connections(net) for net in population.all_nets) / len(population.all_nets),
+                "feed_forward": bench_feed_forward(population, args.calls, args.repeat, args.seed),
+                "game": bench_games(population, min(args.games, len(population.all_nets) // 2), args.frames, args.seed),
+                "fast_forward": bench_fast_forward(population, min(args.games, len(population.all_nets) // 2),
+                                                   args.action_repeat, args.seed),
+                "generate_offspring": bench_offspring(population, args.repeat, args.seed),
+                "files": bench_files(population, args.repeat, args.seed, directory)}
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as fout:
+            fout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import mmap
+import struct
+from array import array
+from os import path, replace
+from sys import argv, byteorder, exit
+import numpy as np
+from NeuralNet import Brain, Population
+
+# Binary population checkpoints
+#
+# header:  magic, format version, generation, number of nets, input nodes, output nodes
+# index:   one (offset, node count, connection count) entry per net
+# nets:    per net, 8 byte aligned: conn_weight (float64), node_layer, conn_from, conn_to (int32), conn_active (int8)
+#
+# Everything is little-endian. Thanks to the index a single net can be read straight from a memory map without
+# looking at any of the others.
+
+magic = b"TFPC"
+version = 1
+header_struct = struct.Struct("<4sHiiii")
+index_struct = struct.Struct("<qii")
+
+
+def to_little_endian(values):
+    if byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def from_little_endian(values):
+    if byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def pack_genome(brain):
+    data = b"".join((to_little_endian(brain.conn_weight).tobytes(), to_little_endian(brain.node_layer).tobytes(),
+                     to_little_endian(brain.conn_from).tobytes(), to_little_endian(brain.conn_to).tobytes(),
+                     brain.conn_active.tobytes()))
+    return data + b"\0" * (-len(data) % 8)
+
+
+def unpack_genome(buffer, offset, node_count, conn_count):
+    # Returns the genome tuple Brain() takes and the offset of whatever follows the (padded) genome
+    columns = []
+    for typecode, count in (("d", conn_count), ("i", node_count), ("i", conn_count), ("i", conn_count), ("b", conn_count)):
+        column = array(typecode)
+        column.frombytes(buffer[offset:offset + count * column.itemsize])
+        columns.append(from_little_endian(column))
+        offset += count * column.itemsize
+
+    conn_weight, node_layer, conn_from, conn_to, conn_active = columns
+    return (node_layer, conn_from, conn_to, conn_weight, conn_active), offset + (-offset % 8)
+
+
+def pack_checkpoint(gen, brains):
+    input_nodes = brains[0].input_nodes if brains else 0
+    output_nodes = brains[0].output_nodes if brains else 0
+    blocks = [pack_genome(brain) for brain in brains]
+
+    offset = header_struct.size + index_struct.size * len(brains)
+    offset += -offset % 8
+    index = []
+    for brain, block in zip(brains, blocks):
+        index.append(index_struct.pack(offset, len(brain.node_layer), brain.conn_number))
+        offset += len(block)
+
+    header = header_struct.pack(magic, version, gen, len(brains), input_nodes, output_nodes) + b"".join(index)
+    header += b"\0" * (-len(header) % 8)
+    return header + b"".join(blocks)
+
+
+def write_checkpoint(filename, gen, brains):
+    # Write next to the target and swap it in, so readers never see a half written checkpoint
+    with open(filename + ".tmp", "wb") as fout:
+        fout.write(pack_checkpoint(gen, brains))
+    replace(filename + ".tmp", filename)
+
+
+class CheckpointReader:
+    # Random access to the nets of a binary checkpoint through a memory map. offset is where the checkpoint starts
+    # in the file, which is not 0 for the full snapshots inside a checkpoint log
+
+    def __init__(self, filename, offset=0):
+        self.file = open(filename, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = offset
+        file_magic, file_version, self.gen, self.net_count, self.input_nodes, self.output_nodes = header_struct.unpack_from(self.map, offset)
+        if file_magic != magic or file_version != version:
+            self.close()
+            raise ValueError("%s is not a version %d population checkpoint" % (filename, version))
+
+    def __len__(self):
+        return self.net_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def read_brain(self, num):
+        if not 0 <= num < self.net_count:
+            raise IndexError("checkpoint has no net %d" % num)
+        offset, node_count, conn_count = index_struct.unpack_from(self.map, self.offset + header_struct.size + num * index_struct.size)
+        genome, end = unpack_genome(self.map, self.offset + offset, node_count, conn_count)
+        return Brain(self.input_nodes, self.output_nodes, genome)
+
+
+def read_checkpoint(filename):
+    with CheckpointReader(filename) as reader:
+        return reader.gen, [reader.read_brain(i) for i in range(len(reader))]
+
+
+# Checkpoint log
+#
+# An append-only file holding every saved generation. Most generations are stored as deltas against the generation
+# before them: per net the index of its parent plus the node layers, weights and active flags that changed and the
+# nodes and connections that were appended. Every snapshot_interval records, and whenever there is no parent
+# information, the whole generation is stored as a full snapshot (a complete binary checkpoint), so reading any
+# generation only needs the nearest snapshot before it and the deltas in between.
+#
+# header:  magic, format version
+# records: kind (FULL or DLTA), generation, number of nets, payload size, payload
+
+log_magic = b"TFCL"
+log_version = 1
+log_header_struct = struct.Struct("<4sH")
+record_struct = struct.Struct("<4siiq")
+# parent index (-1 if the whole genome follows), node count, connection count, changed layers, changed active flags
+delta_struct = struct.Struct("<iiiii")
+snapshot_interval = 25
+
+native_dtypes = {"i": np.intc, "d": np.float64, "b": np.int8}
+
+
+def as_array(typecode, values):
+    column = array(typecode)
+    column.frombytes(np.ascontiguousarray(values, dtype=native_dtypes[typecode]).tobytes())
+    return column
+
+
+def take(buffer, offset, dtype, count):
+    values = np.frombuffer(buffer, dtype, count, offset)
+    return values, offset + values.nbytes
+
+
+def pack_delta(child, parent, parent_num):
+    parent_nodes = len(parent.node_layer)
+    parent_conns = parent.conn_number
+    node_count = len(child.node_layer)
+    conn_count = child.conn_number
+    if node_count < parent_nodes or conn_count < parent_conns or child.input_nodes != parent.input_nodes or \
+            child.conn_from[:parent_conns] != parent.conn_from[:parent_conns] or \
+            child.conn_to[:parent_conns] != parent.conn_to[:parent_conns]:
+        # Not something mutate() produces from this parent, store the whole genome
+        return delta_struct.pack(-1, node_count, conn_count, 0, 0) + pack_genome(child)
+
+    layer = np.frombuffer(child.node_layer, np.intc)
+    weight = np.frombuffer(child.conn_weight, np.float64)
+    active = np.frombuffer(child.conn_active, np.int8)
+    layer_changed = np.flatnonzero(layer[:parent_nodes] != np.frombuffer(parent.node_layer, np.intc))
+    weight_changed = weight[:parent_conns] != np.frombuffer(parent.conn_weight, np.float64)
+    active_changed = np.flatnonzero(active[:parent_conns] != np.frombuffer(parent.conn_active, np.int8))
+
+    # Mutation changes most weights of a net, so the changed weights are marked in a bitmap instead of listed
+    return b"".join((delta_struct.pack(parent_num, node_count, conn_count, len(layer_changed), len(active_changed)),
+                     layer_changed.astype("<i4").tobytes(), layer[layer_changed].astype("<i4").tobytes(),
+                     layer[parent_nodes:].astype("<i4").tobytes(),
+                     np.packbits(weight_changed, bitorder="little").tobytes(),
+                     weight[:parent_conns][weight_changed].astype("<f8").tobytes(),
+                     active_changed.astype("<i4").tobytes(), active[active_changed].tobytes(),
+                     np.frombuffer(child.conn_from, np.intc)[parent_conns:].astype("<i4").tobytes(),
+                     np.frombuffer(child.conn_to, np.intc)[parent_conns:].astype("<i4").tobytes(),
+                     weight[parent_conns:].astype("<f8").tobytes(), active[parent_conns:].tobytes()))
+
+
+def unpack_delta(buffer, offset, parents):
+    # Returns the net stored at offset and the offset of the next one
+    parent_num, node_count, conn_count, layers_changed, actives_changed = delta_struct.unpack_from(buffer, offset)
+    offset += delta_struct.size
+    if parent_num < 0:
+        genome, offset = unpack_genome(buffer, offset, node_count, conn_count)
+        return Brain(parents[0].input_nodes, parents[0].output_nodes, genome), offset
+
+    parent = parents[parent_num]
+    parent_nodes = len(parent.node_layer)
+    parent_conns = parent.conn_number
+
+    layer_index, offset = take(buffer, offset, "<i4", layers_changed)
+    layer_values, offset = take(buffer, offset, "<i4", layers_changed)
+    new_layers, offset = take(buffer, offset, "<i4", node_count - parent_nodes)
+    bitmap, offset = take(buffer, offset, np.uint8, (parent_conns + 7) // 8)
+    weight_changed = np.unpackbits(bitmap, count=parent_conns, bitorder="little").astype(bool)
+    weight_values, offset = take(buffer, offset, "<f8", int(weight_changed.sum()))
+    active_index, offset = take(buffer, offset, "<i4", actives_changed)
+    active_values, offset = take(buffer, offset, np.int8, actives_changed)
+    new_from, offset = take(buffer, offset, "<i4", conn_count - parent_conns)
+    new_to, offset = take(buffer, offset, "<i4", conn_count - parent_conns)
+    new_weights, offset = take(buffer, offset, "<f8", conn_count - parent_conns)
+    new_active, offset = take(buffer, offset, np.int8, conn_count - parent_conns)
+
+    if node_count == parent_nodes and conn_count == parent_conns and not layers_changed and not actives_changed \
+            and not len(weight_values):
+        # Unchanged (an elite), share the parent's genome
+        return parent.clone(), offset
+
+    layer = np.concatenate((np.frombuffer(parent.node_layer, np.intc), new_layers))
+    layer[layer_index] = layer_values
+    weight = np.concatenate((np.frombuffer(parent.conn_weight, np.float64), new_weights))
+    weight[:parent_conns][weight_changed] = weight_values
+    active = np.concatenate((np.frombuffer(parent.conn_active, np.int8), new_active))
+    active[active_index] = active_values
+    genome = (as_array("i", layer),
+              as_array("i", np.concatenate((np.frombuffer(parent.conn_from, np.intc), new_from))),
+              as_array("i", np.concatenate((np.frombuffer(parent.conn_to, np.intc), new_to))),
+              as_array("d", weight), as_array("b", active))
+    return Brain(parent.input_nodes, parent.output_nodes, genome), offset
+
+
+class CheckpointLog:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = []  # (kind, gen, net count, payload offset, payload size) of every complete record
+        # The generation written last and its nets, the next generation's deltas are taken against them
+        self.last_gen = None
+        self.last_brains = None
+        # End of the last complete record. Anything after it is a record cut short by a crash, or one another process
+        # is still writing, and is left alone until this log appends a record itself
+        self.end = log_header_struct.size
+
+        if path.isfile(filename):
+            self.scan()
+        else:
+            with open(filename, "wb") as fout:
+                fout.write(log_header_struct.pack(log_magic, log_version))
+
+    def scan(self):
+        # Only the record headers are read, the payloads are skipped. The file is never changed here, so logs can be
+        # read while a training run appends to them
+        with open(self.filename, "rb") as fin:
+            file_magic, file_version = log_header_struct.unpack(fin.read(log_header_struct.size))
+            if file_magic != log_magic or file_version != log_version:
+                raise ValueError("%s is not a version %d checkpoint log" % (self.filename, log_version))
+            file_size = fin.seek(0, 2)
+            end = log_header_struct.size
+            while end + record_struct.size <= file_size:
+                fin.seek(end)
+                kind, gen, net_count, size = record_struct.unpack(fin.read(record_struct.size))
+                if end + record_struct.size + size > file_size:
+                    break
+                self.records.append((kind, gen, net_count, end + record_struct.size, size))
+                end += record_struct.size + size
+        self.end = end
+
+    def generations(self):
+        return [record[1] for record in self.records]
+
+    def append(self, gen, brains, parents=None):
+        # parents[i] is the index of brains[i]'s parent in the generation appended before this one
+        if brains is self.last_brains:
+            return  # already in the log
+
+        since_snapshot = 0
+        for record in reversed(self.records):
+            if record[0] == b"FULL":
+                break
+            since_snapshot += 1
+
+        if parents is None or self.last_brains is None or self.last_gen != gen - 1 or \
+                len(self.records) == 0 or since_snapshot + 1 >= snapshot_interval:
+            kind = b"FULL"
+            payload = pack_checkpoint(gen, brains)
+        else:
+            kind = b"DLTA"
+            payload = b"".join(pack_delta(brain, self.last_brains[parent], parent) for brain, parent in zip(brains, parents))
+
+        with open(self.filename, "r+b") as fout:
+            fout.seek(self.end)
+            fout.truncate()  # Drops a record cut short by a crash, so that appending continues from a clean end
+            fout.write(record_struct.pack(kind, gen, len(brains), len(payload)) + payload)
+        self.records.append((kind, gen, len(brains), self.end + record_struct.size, len(payload)))
+        self.end += record_struct.size + len(payload)
+        self.last_gen = gen
+        self.last_brains = brains
+
+    def read_generation(self, gen=None):
+        # Returns (gen, nets) of the given generation, by default the last one in the log
+        if not self.records:
+            raise ValueError("%s holds no generations" % self.filename)
+        target = len(self.records) - 1
+        if gen is not None:
+            while target >= 0 and self.records[target][1] != gen:
+                target -= 1
+            if target < 0:
+                raise KeyError("generation %d is not in %s" % (gen, self.filename))
+
+        start = target
+        while self.records[start][0] != b"FULL":
+            start -= 1
+
+        with CheckpointReader(self.filename, self.records[start][3]) as reader:
+            brains = [reader.read_brain(i) for i in range(len(reader))]
+        with open(self.filename, "rb") as fin:
+            for kind, record_gen, net_count, offset, size in self.records[start + 1:target + 1]:
+                fin.seek(offset)
+                payload = fin.read(size)
+                parents = brains
+                brains = []
+                offset = 0
+                for i in range(net_count):
+                    brain, offset = unpack_delta(payload, offset, parents)
+                    brains.append(brain)
+
+        if target == len(self.records) - 1:
+            self.last_gen = self.records[target][1]
+            self.last_brains = brains
+        return self.records[target][1], brains
+
+
+def convert(source, destination, gen=None):
+    # Convert between the JSON and the binary population formats, the formats are picked by file extension. gen picks
+    # a generation out of a checkpoint log, by default its last one is taken
+    if not path.isfile(source):
+        raise FileNotFoundError(source)
+    population = Population(source)
+    if gen is not None:
+        if population.log is None:
+            raise ValueError("only checkpoint logs hold more than one generation")
+        population.gen, population.all_nets = population.log.read_generation(gen)
+    population.filename = destination
+    population.log = None
+    population.parents = None
+    population.save_to_file()
+
+
+if __name__ == "__main__":
+    if len(argv) not in (3, 4):
+        print("usage: python checkpoint.py <source population> <destination population> [generation]")
+        print("       files ending in .ckpt are binary checkpoints, .ckptlog checkpoint logs and anything else is JSON")
+        exit(1)
+    convert(argv[1], argv[2], int(argv[3]) if len(argv) == 4 else None)
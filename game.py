@@ -1,16 +1,23 @@
-from datetime import datetime
-import pygame
-from time import sleep
+from time import sleep, perf_counter
 from os import environ
-from math import sin, floor, pi, sqrt
-from NeuralNet import Population
-from sys import argv
-from random import uniform
+from math import sin, floor, ceil, pi, sqrt, log
+from NeuralNet import Population, BrainBatch, select_activation
+from phasetimer import PhaseTimer, append_jsonl
+import numpy as np
+from random import Random, seed
+import multiprocessing
+import threading
+import argparse
 
 max_frame_rate = 480
 active_game = 0
 show_all_games = True
 
+pygame = None  # Only imported by init_display(), headless runs never touch SDL
+screen = None
+myfont = None
+background = None  # Goals and stick rods, see draw_background()
+
 
 class Table:
     # Various properties of the table and its representation
@@ -61,6 +68,18 @@ class Table:
     opponent_fitness_argument_coeff = 2
 
 
+# Furthest a ball's center can be from a stick's x position while still touching one of its foosmen, whatever the angle
+stick_reach = Table.player_height / 2 + Table.player_thickness / 2 + Table.ball_radius
+# and while the stick is rotated into hitting range, plus a pixel of slack against rounding
+hit_reach_x = Table.player_height / 2 * sin(Table.player_angle_hit_limit) + Table.player_thickness / 2 + Table.ball_radius + 1
+hit_reach_y = Table.player_width / 2 + Table.ball_radius + 1  # Furthest from a foosman's center along the stick
+
+glide_frames = 24  # Ball.advance() steps jumps up to this long frame by frame, beyond that glide() is faster
+min_jump = 2  # Game.fast_forward() costs about as much as a frame, so it doesn't skip single frames
+
+action_size = 8  # Brain outputs per opponent, see Game.apply_outputs()
+
+
 class PlayerRole:  # Bind player role to an integer
     keeper = 0
     defence = 1
@@ -82,6 +101,98 @@ def get_dist(x1, y1, x2, y2):
     return sqrt((x2 - x1)**2 + (y2 - y1)**2)
 
 
+def frames_before(distance, speed, limit):
+    # Whole frames, up to limit, that something moving by at most speed per frame can go on for without covering
+    # distance
+    if distance <= 0:
+        return 0
+    if distance > limit * speed:
+        return limit
+    return max(int(ceil(distance / speed)) - 1, 0)
+
+
+def roll_speed(vel, frames):
+    # Fastest a freely rolling ball with velocity vel along an axis moves along it per frame in the next frames frames.
+    # Friction slows it down in the positive direction, but as vel -= f * vel**2 it speeds negative velocities up,
+    # until the speed limit holds them at max_vel + f * max_vel**2. In terms of glide()'s z they grow by less than
+    # z / (1 - z * steps) in steps steps
+    max_vel, f = Table.ball_max_vel, Table.ball_table_friction_coefficient
+    if vel >= 0:
+        return min(vel, max_vel)
+    limit_speed = max_vel + f * max_vel * max_vel
+    speed = min(-vel, max_vel)
+    speed += f * speed * speed  # After the first frame
+    growth = 1 - f * speed * (frames - 1)
+    if growth <= 0:
+        return limit_speed
+    return min(speed / growth, limit_speed)
+
+
+def friction_sums(z0, z, s):
+    # For z stepping from z0 to z by z += s * z**2, with s 1 or -1 and z small: the sum of the z it stepped from and
+    # how much more 1 / z changed than by -s per step. Both from ln(1 + s * z) and telescoping sums of powers of z,
+    # up to the fourth
+    squares = s * (z - z0)
+    fourths = s * (z ** 3 - z0 ** 3) / 3
+    cubes = s * (z * z - z0 * z0 - fourths) / 2
+    total = s * (log(z / z0) + squares / 2 - s * cubes / 3 + fourths / 4)
+    return total, total - s * squares + cubes - s * fourths
+
+
+def friction_steps(z0, steps, s):
+    # z after steps steps of z += s * z**2 and the sum of the z it stepped from, see friction_sums(). 1 / z changes by
+    # -s per step plus a drift of about the sum of the z, ln(z / z0), which only weakly depends on where z ends up, so
+    # a fixed point iteration from that estimate converges quickly
+    u0 = 1 / z0
+    u = u0 - s * steps - s * log((u0 - s * steps) / u0)
+    for i in range(2):
+        total, drift = friction_sums(z0, 1 / u, s)
+        u = u0 - s * steps + drift
+    return 1 / u, friction_sums(z0, 1 / u, s)[0]
+
+
+def glide(pos, vel, frames):
+    # Position and velocity along one axis after frames frames of Ball.update() without collisions, in closed form.
+    # After the first frame, which applies the speed limit, the velocity follows vel -= f * vel**2 with the friction
+    # coefficient f: z = f * abs(vel) steps by z -= z**2 for positive velocities and by z += z**2 for negative ones,
+    # until these reach the speed limit. Within a thousandth of a pixel of stepping for the jumps Game.fast_forward()
+    # makes
+    max_vel, f = Table.ball_max_vel, Table.ball_table_friction_coefficient
+    vel = min(max(vel, -max_vel), max_vel)
+    vel -= f * vel * vel
+    pos += vel
+    frames -= 1
+    if frames <= 0:
+        return pos, vel
+    if f * abs(vel) < 1e-12:  # Friction no longer changes the velocity measurably
+        return pos + frames * vel, vel
+
+    if vel > 0:
+        z, total = friction_steps(f * vel, frames, -1)
+        return pos + (total - f * vel + z) / f, z / f
+
+    # Steps until the velocity is beyond the limit, after which it stays at max_vel + f * max_vel**2
+    z0 = -f * vel
+    z_limit = f * max_vel
+    growing = 0
+    if z0 <= z_limit:
+        growing = int(1 / z0 - 1 / z_limit + log(z_limit / z0)) + 1
+        if growing <= frames:  # The estimate can be a step off, but only matters within the jump
+            while growing > 1 and friction_steps(z0, growing - 1, 1)[0] > z_limit:
+                growing -= 1
+            while growing < frames and friction_steps(z0, growing, 1)[0] <= z_limit:
+                growing += 1
+        growing = min(growing, frames)
+    if growing:
+        z, total = friction_steps(z0, growing, 1)
+        pos -= (total - z0 + z) / f
+        vel = -z / f
+    if growing < frames:
+        vel = -(max_vel + f * max_vel ** 2)
+        pos += (frames - growing) * vel
+    return pos, vel
+
+
 class PlayerStick:
 
     def __init__(self, opponent_num, player_type, game):
@@ -154,10 +265,62 @@ class PlayerStick:
         self.rot_pos += self.rot_vel
         self.rot_pos = mod2pi(self.rot_pos)
 
-    def draw(self):
-        pygame.draw.rect(screen, Table.stick_color, (self.pos_x - Table.stick_width/2, 0, Table.stick_width, Table.width), Table.stick_border)  # draw the stick
-        for player in range(self.players):  # Draw each foosman on the stick taking into account their rotation angles
-            pygame.draw.rect(screen, self.color, (self.pos_x - Table.player_thickness / 2 - int(round(Table.player_height / 2 * sin(self.rot_pos))), ((player + 1)/(self.players + 1)) * Table.width - Table.player_width / 2 + self.lin_pos, Table.player_thickness + int(round(Table.player_height * sin(self.rot_pos))), Table.player_width), Table.player_border)
+    def advance(self, frames):
+        # Exactly what frames update() calls do, with the attribute lookups done once. A stick pushed against an end of
+        # its moving range stays there, only its rotation has to be stepped then
+        max_lin_vel, max_rot_vel = Table.player_max_lin_vel, Table.player_max_rot_vel
+        lin_pos, lin_vel, lin_acc, lin_range = self.lin_pos, self.lin_vel, self.lin_acc, self.lin_range
+        pinned = (lin_acc == 0 or (lin_vel == max_lin_vel and lin_acc > 0) or (lin_vel == -max_lin_vel and lin_acc < 0)) \
+            and ((lin_pos == lin_range and lin_vel >= 0) or (lin_pos == -lin_range and lin_vel <= 0))
+        if not pinned:
+            for frame in range(frames):
+                lin_vel += lin_acc
+                if lin_vel > max_lin_vel:
+                    lin_vel = max_lin_vel
+                elif lin_vel < -max_lin_vel:
+                    lin_vel = -max_lin_vel
+                lin_pos = int(round(lin_pos + lin_vel))
+                if lin_pos < -lin_range:
+                    lin_pos = -lin_range
+                elif lin_pos > lin_range:
+                    lin_pos = lin_range
+            self.lin_pos, self.lin_vel = lin_pos, lin_vel
+
+        rot_pos, rot_vel, rot_acc = self.rot_pos, self.rot_vel, self.rot_acc
+        for frame in range(frames):
+            rot_vel += rot_acc
+            if rot_vel > max_rot_vel:
+                rot_vel = max_rot_vel
+            elif rot_vel < -max_rot_vel:
+                rot_vel = -max_rot_vel
+            rot_pos = mod2pi(rot_pos + rot_vel)
+        self.rot_pos, self.rot_vel = rot_pos, rot_vel
+
+    def safe_frames(self, ball, speed_x, speed_y, limit):
+        # Frames, up to limit, for which none of this stick's foosmen can touch a freely rolling ball that moves by at
+        # most speed_x and speed_y per frame. That holds as long as the ball is out of reach of the stick's lane, or the
+        # stick is rotated out of hitting range, or the nearest foosman is out of reach along the stick. The stick's
+        # speeds are bounded with its accelerations kept for limit frames
+        frames = 0
+        ball_x, ball_y = ball.pos_x, ball.pos_y
+        distance = abs(ball_x - self.pos_x) - hit_reach_x
+        if distance > 0:
+            if (ball_x - self.pos_x) * ball.vel_x >= 0:  # Not rolling towards the lane, the ball never turns freely
+                return limit
+            frames = frames_before(distance, speed_x, limit)
+
+        distance = abs(self.rot_pos) - Table.player_angle_hit_limit
+        if distance > 0 and frames < limit:
+            rot_speed = min(Table.player_max_rot_vel, abs(self.rot_vel) + limit * abs(self.rot_acc))
+            frames = max(frames, frames_before(distance, rot_speed, limit))
+
+        i = min(max(int(round((ball_y - self.lin_pos) * (self.players + 1) / Table.width)) - 1, 0), self.players - 1)
+        distance = abs(ball_y - (((i + 1) / (self.players + 1)) * Table.width + self.lin_pos)) - hit_reach_y
+        if distance > 0 and frames < limit:
+            # Half a pixel more for the rounding of the stick position
+            lin_speed = min(Table.player_max_lin_vel, abs(self.lin_vel) + limit * abs(self.lin_acc)) + 0.5
+            frames = max(frames, frames_before(distance, speed_y + lin_speed, limit))
+        return frames
 
 
 class Opponent:
@@ -169,36 +332,14 @@ class Opponent:
         self.score = 0
         self.own_goals = 0
         self.sticks = []
-        self.collision_rects = []  # Store collision rectangles
         for role in range(4):  # Generate 4 sticks with roles 0 to 3 (roles defined as integers in the PlayerRole class)
             self.sticks.append(PlayerStick(opponent_num, role, game))
 
-    def draw(self):
-        # Draw all sticks and foosmen
-        for stick in self.sticks:
-            stick.draw()
-
-        if Table.debug:  # Draw collision boxes
-            for collision_rect in self.collision_rects:
-                pygame.draw.rect(screen, Table.collision_box_color, collision_rect["pygame_tuple"], Table.collision_box_border)
-
-    def build_collision_boxes(self):  # Generate collision boxes and add them to a list
-        self.collision_rects = []     # Collisions are stored with center coordinates and a tuple for pygame drawing
-        for stick in self.sticks:
-            if abs(stick.rot_pos) < Table.player_angle_hit_limit:
-                collision_rect_x = stick.pos_x + Table.player_height / 2 * sin(stick.rot_pos)
-                for i in range(stick.players):
-                    collision_rect_y = ((i + 1) / (stick.players + 1)) * Table.width + stick.lin_pos
-                    collision_rect = {"playerRole": stick.player_role, "center_x": collision_rect_x, "center_y": collision_rect_y, "pygame_tuple": (collision_rect_x - Table.player_thickness / 2, collision_rect_y - Table.player_width / 2, Table.player_thickness, Table.player_width)}
-                    self.collision_rects.append(collision_rect)
-
     def update(self):
         # Update velocities, positions and rotation angles
         for stick in self.sticks:
             stick.update()
 
-        self.build_collision_boxes()
-
 
 class Ball:
 
@@ -207,91 +348,24 @@ class Ball:
         self.pos_y = int(round(Table.width / 2))
         self.acc_x = 0
         self.acc_y = 0
-        self.vel_x = uniform(-0.2, 0.2) * Table.ball_max_vel
-        self.vel_y = uniform(-0.2, 0.2) * Table.ball_max_vel
+        self.vel_x = game.random.uniform(-0.2, 0.2) * Table.ball_max_vel
+        self.vel_y = game.random.uniform(-0.2, 0.2) * Table.ball_max_vel
         self.game = game
         self.last_player_touched = None
 
     def check_collision(self):
+        # Broad phase: a foosman can only touch the ball if its stick is rotated into hitting range and the ball is
+        # within stick_reach of the stick's fixed x position, and along the stick only the foosman closest to the ball
+        # can be within reach, as the foosmen are further apart than twice (player_width / 2 + ball_radius)
         for opponent in self.game.opponents:
-            for collision_box in opponent.collision_rects:
-                # print(collision_box)
-                # print((collision_box["center_y"] + Table.player_width / 2) <= (self.pos_y + Table.ball_radius))
-                # print((self.pos_y - Table.ball_radius) <= (collision_box["center_y"] + Table.player_width / 2))
-                if (collision_box["center_y"] - Table.player_width / 2) <= self.pos_y <= (collision_box["center_y"] + Table.player_width / 2):
-                    # print("correct height detected")
-                    if ((self.pos_x + Table.ball_radius) >= collision_box["center_x"] - Table.player_thickness / 2) and ((self.pos_x - Table.ball_radius) <= (collision_box["center_x"] + Table.player_thickness / 2)):
-                        if self.vel_x < opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height:  # Ball hit right side of hitbox
-                            self.pos_x = collision_box["center_x"] + Table.player_thickness / 2 + Table.ball_radius + 1
-                        elif self.vel_x > opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height:  # Ball hit left side of hitbox
-                            self.pos_x = collision_box["center_x"] - Table.player_thickness / 2 - Table.ball_radius - 1
-                        self.vel_x = (- self.vel_x) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height  # Change velocity sign and account for energy loss and add player rot speed
-                        self.vel_y = self.vel_y * Table.player_hit_cin_energy_efficiency  # Change velocity sign and account for energy loss
-                        opponent.brain.hit_ball = True
-                        self.last_player_touched = opponent.opponent_num
-
-                elif (collision_box["center_x"] - Table.player_thickness / 2) <= self.pos_x <= (collision_box["center_x"] + Table.player_thickness / 2):
-                    if ((self.pos_y + Table.ball_radius) >= collision_box["center_y"] - Table.player_width / 2) and ((self.pos_y - Table.ball_radius) <= collision_box["center_y"] + Table.player_width / 2):
-                        if self.vel_y < opponent.sticks[collision_box["playerRole"]].lin_vel:  # Ball hit lower side of hitbox
-                            self.pos_y = collision_box["center_y"] + Table.player_width / 2 + Table.ball_radius + 1
-                        elif self.vel_y > opponent.sticks[collision_box["playerRole"]].lin_vel:  # Ball hit upper side of hitbox
-                            self.pos_y = collision_box["center_y"] - Table.player_width / 2 - Table.ball_radius - 1
-                        self.vel_x = self.vel_x * Table.player_hit_cin_energy_efficiency   # Change velocity sign and account for energy loss
-                        self.vel_y = (- self.vel_y) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].lin_vel  # Change velocity sign and account for energy loss and add player lin speed
-                        opponent.brain.hit_ball = True
-                        self.last_player_touched = opponent.opponent_num
-
-                elif (self.pos_x <= collision_box["center_x"] - Table.player_thickness / 2) and (self.pos_y <= collision_box["center_y"] - Table.player_width / 2):  # Upper left corner
-                    if get_dist(self.pos_x, self.pos_y, collision_box["center_x"] - Table.player_thickness / 2, collision_box["center_y"] - Table.player_width / 2) <= Table.ball_radius:  # Collisions
-                        x = self.pos_x - (collision_box["center_x"] - Table.player_thickness / 2)
-                        y = self.pos_y - (collision_box["center_y"] - Table.player_width / 2)
-                        c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
-                        self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height
-                        self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].lin_vel
-                        tan_a = ((collision_box["center_y"] - Table.player_width / 2) - self.pos_y) / (((collision_box["center_x"]) - Table.player_thickness / 2) - self.pos_x)
-                        self.pos_x = (collision_box["center_x"] - Table.player_thickness / 2) - (Table.ball_radius + 1) / (sqrt(1 + tan_a ** 2))
-                        self.pos_y = (self.pos_x - (collision_box["center_x"] - Table.player_thickness / 2)) * tan_a + (collision_box["center_y"] - Table.player_width / 2)
-                        opponent.brain.hit_ball = True
-                        self.last_player_touched = opponent.opponent_num
-
-                elif (self.pos_x <= collision_box["center_x"] - Table.player_thickness / 2) and (self.pos_y >= collision_box["center_y"] + Table.player_width / 2):  # Lower left corner
-                    if get_dist(self.pos_x, self.pos_y, collision_box["center_x"] - Table.player_thickness / 2, collision_box["center_y"] + Table.player_width / 2) <= Table.ball_radius:  # Collisions
-                        x = self.pos_x - (collision_box["center_x"] - Table.player_thickness / 2)
-                        y = self.pos_y - (collision_box["center_y"] + Table.player_width / 2)
-                        c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
-                        self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height
-                        self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].lin_vel
-                        tan_a = (self.pos_y - (collision_box["center_y"] + Table.player_width / 2)) / (((collision_box["center_x"]) - Table.player_thickness / 2) - self.pos_x)
-                        self.pos_x = (collision_box["center_x"] - Table.player_thickness / 2) - (Table.ball_radius + 1) / (sqrt(1 + tan_a ** 2))
-                        self.pos_y = ((collision_box["center_x"] - Table.player_thickness / 2) - self.pos_x) * tan_a + (collision_box["center_y"] + Table.player_width / 2)
-                        opponent.brain.hit_ball = True
-                        self.last_player_touched = opponent.opponent_num
-
-                elif (self.pos_x >= collision_box["center_x"] + Table.player_thickness / 2) and (self.pos_y <= collision_box["center_y"] - Table.player_width / 2):  # Upper right corner
-                    if get_dist(self.pos_x, self.pos_y, collision_box["center_x"] + Table.player_thickness / 2, collision_box["center_y"] - Table.player_width / 2) <= Table.ball_radius:  # Collisions
-                        x = self.pos_x - (collision_box["center_x"] + Table.player_thickness / 2)
-                        y = self.pos_y - (collision_box["center_y"] - Table.player_width / 2)
-                        c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
-                        self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height
-                        self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].lin_vel
-                        tan_a = ((collision_box["center_y"] - Table.player_width / 2) - self.pos_y) / (self.pos_x - ((collision_box["center_x"]) + Table.player_thickness / 2))
-                        self.pos_x = + (collision_box["center_x"] + Table.player_thickness / 2) + (Table.ball_radius + 1) / (sqrt(1 + tan_a**2))
-                        self.pos_y = ((collision_box["center_x"] + Table.player_thickness / 2) - self.pos_x) * tan_a + (collision_box["center_y"] - Table.player_width / 2)
-                        opponent.brain.hit_ball = True
-                        self.last_player_touched = opponent.opponent_num
-
-                elif (self.pos_x >= collision_box["center_x"] + Table.player_thickness / 2) and (self.pos_y >= collision_box["center_y"] + Table.player_width / 2):  # Lower right corner
-                    if get_dist(self.pos_x, self.pos_y, collision_box["center_x"] + Table.player_thickness / 2, collision_box["center_y"] + Table.player_width / 2) <= Table.ball_radius:  # Collisions
-                        x = self.pos_x - (collision_box["center_x"] + Table.player_thickness / 2)
-                        y = self.pos_y - (collision_box["center_y"] + Table.player_width / 2)
-                        c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
-                        self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].rot_vel * Table.player_height
-                        self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + opponent.sticks[collision_box["playerRole"]].lin_vel
-                        tan_a = (self.pos_y - (collision_box["center_y"] + Table.player_width / 2)) / (self.pos_x - ((collision_box["center_x"]) + Table.player_thickness / 2))
-                        self.pos_x = + (collision_box["center_x"] + Table.player_thickness / 2) + (Table.ball_radius + 1) / (sqrt(1 + tan_a**2))
-                        self.pos_y = (self.pos_x - (collision_box["center_x"] + Table.player_thickness / 2)) * tan_a + (collision_box["center_y"] + Table.player_width / 2)
-                        opponent.brain.hit_ball = True
-                        self.last_player_touched = opponent.opponent_num
+            for stick in opponent.sticks:
+                if abs(self.pos_x - stick.pos_x) > stick_reach or abs(stick.rot_pos) >= Table.player_angle_hit_limit:
+                    continue
+                i = int(round((self.pos_y - stick.lin_pos) * (stick.players + 1) / Table.width)) - 1
+                if 0 <= i < stick.players:
+                    center_x = stick.pos_x + Table.player_height / 2 * sin(stick.rot_pos)
+                    center_y = ((i + 1) / (stick.players + 1)) * Table.width + stick.lin_pos
+                    self.collide_box(opponent, stick, center_x, center_y)
 
         if self.pos_x - Table.ball_radius <= 0:  # Left edge collision
             self.pos_x = Table.ball_radius + 1
@@ -317,8 +391,8 @@ class Ball:
                         stick.rot_acc = 0
                 self.pos_x = Table.length / 2
                 self.pos_y = Table.width / 2
-                self.vel_x = uniform(-0.2, 0.2) * Table.ball_max_vel
-                self.vel_y = uniform(-0.2, 0.2) * Table.ball_max_vel
+                self.vel_x = self.game.random.uniform(-0.2, 0.2) * Table.ball_max_vel
+                self.vel_y = self.game.random.uniform(-0.2, 0.2) * Table.ball_max_vel
 
         if self.pos_x + Table.ball_radius >= Table.length:  # Right edge collision
             self.pos_x = Table.length - Table.ball_radius - 1
@@ -344,8 +418,8 @@ class Ball:
                         stick.rot_acc = 0
                 self.pos_x = Table.length / 2
                 self.pos_y = Table.width / 2
-                self.vel_x = uniform(-0.2, 0.2) * Table.ball_max_vel
-                self.vel_y = uniform(-0.2, 0.2) * Table.ball_max_vel
+                self.vel_x = self.game.random.uniform(-0.2, 0.2) * Table.ball_max_vel
+                self.vel_y = self.game.random.uniform(-0.2, 0.2) * Table.ball_max_vel
 
         if self.pos_y - Table.ball_radius <= 0:  # Upper edge collision
             self.pos_y = Table.ball_radius + 1
@@ -357,6 +431,82 @@ class Ball:
             self.vel_x = self.vel_x * Table.edge_hit_cin_energy_efficiency
             self.vel_y = (- self.vel_y) * Table.edge_hit_cin_energy_efficiency
 
+    def collide_box(self, opponent, stick, center_x, center_y):  # Narrow phase against a single collision box
+        if (center_y - Table.player_width / 2) <= self.pos_y <= (center_y + Table.player_width / 2):
+            # print("correct height detected")
+            if ((self.pos_x + Table.ball_radius) >= center_x - Table.player_thickness / 2) and ((self.pos_x - Table.ball_radius) <= (center_x + Table.player_thickness / 2)):
+                if self.vel_x < stick.rot_vel * Table.player_height:  # Ball hit right side of hitbox
+                    self.pos_x = center_x + Table.player_thickness / 2 + Table.ball_radius + 1
+                elif self.vel_x > stick.rot_vel * Table.player_height:  # Ball hit left side of hitbox
+                    self.pos_x = center_x - Table.player_thickness / 2 - Table.ball_radius - 1
+                self.vel_x = (- self.vel_x) * Table.player_hit_cin_energy_efficiency + stick.rot_vel * Table.player_height  # Change velocity sign and account for energy loss and add player rot speed
+                self.vel_y = self.vel_y * Table.player_hit_cin_energy_efficiency  # Change velocity sign and account for energy loss
+                opponent.brain.hit_ball = True
+                self.last_player_touched = opponent.opponent_num
+
+        elif (center_x - Table.player_thickness / 2) <= self.pos_x <= (center_x + Table.player_thickness / 2):
+            if ((self.pos_y + Table.ball_radius) >= center_y - Table.player_width / 2) and ((self.pos_y - Table.ball_radius) <= center_y + Table.player_width / 2):
+                if self.vel_y < stick.lin_vel:  # Ball hit lower side of hitbox
+                    self.pos_y = center_y + Table.player_width / 2 + Table.ball_radius + 1
+                elif self.vel_y > stick.lin_vel:  # Ball hit upper side of hitbox
+                    self.pos_y = center_y - Table.player_width / 2 - Table.ball_radius - 1
+                self.vel_x = self.vel_x * Table.player_hit_cin_energy_efficiency   # Change velocity sign and account for energy loss
+                self.vel_y = (- self.vel_y) * Table.player_hit_cin_energy_efficiency + stick.lin_vel  # Change velocity sign and account for energy loss and add player lin speed
+                opponent.brain.hit_ball = True
+                self.last_player_touched = opponent.opponent_num
+
+        elif (self.pos_x <= center_x - Table.player_thickness / 2) and (self.pos_y <= center_y - Table.player_width / 2):  # Upper left corner
+            if get_dist(self.pos_x, self.pos_y, center_x - Table.player_thickness / 2, center_y - Table.player_width / 2) <= Table.ball_radius:  # Collisions
+                x = self.pos_x - (center_x - Table.player_thickness / 2)
+                y = self.pos_y - (center_y - Table.player_width / 2)
+                c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
+                self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + stick.rot_vel * Table.player_height
+                self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + stick.lin_vel
+                tan_a = ((center_y - Table.player_width / 2) - self.pos_y) / (((center_x) - Table.player_thickness / 2) - self.pos_x)
+                self.pos_x = (center_x - Table.player_thickness / 2) - (Table.ball_radius + 1) / (sqrt(1 + tan_a ** 2))
+                self.pos_y = (self.pos_x - (center_x - Table.player_thickness / 2)) * tan_a + (center_y - Table.player_width / 2)
+                opponent.brain.hit_ball = True
+                self.last_player_touched = opponent.opponent_num
+
+        elif (self.pos_x <= center_x - Table.player_thickness / 2) and (self.pos_y >= center_y + Table.player_width / 2):  # Lower left corner
+            if get_dist(self.pos_x, self.pos_y, center_x - Table.player_thickness / 2, center_y + Table.player_width / 2) <= Table.ball_radius:  # Collisions
+                x = self.pos_x - (center_x - Table.player_thickness / 2)
+                y = self.pos_y - (center_y + Table.player_width / 2)
+                c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
+                self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + stick.rot_vel * Table.player_height
+                self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + stick.lin_vel
+                tan_a = (self.pos_y - (center_y + Table.player_width / 2)) / (((center_x) - Table.player_thickness / 2) - self.pos_x)
+                self.pos_x = (center_x - Table.player_thickness / 2) - (Table.ball_radius + 1) / (sqrt(1 + tan_a ** 2))
+                self.pos_y = ((center_x - Table.player_thickness / 2) - self.pos_x) * tan_a + (center_y + Table.player_width / 2)
+                opponent.brain.hit_ball = True
+                self.last_player_touched = opponent.opponent_num
+
+        elif (self.pos_x >= center_x + Table.player_thickness / 2) and (self.pos_y <= center_y - Table.player_width / 2):  # Upper right corner
+            if get_dist(self.pos_x, self.pos_y, center_x + Table.player_thickness / 2, center_y - Table.player_width / 2) <= Table.ball_radius:  # Collisions
+                x = self.pos_x - (center_x + Table.player_thickness / 2)
+                y = self.pos_y - (center_y - Table.player_width / 2)
+                c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
+                self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + stick.rot_vel * Table.player_height
+                self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + stick.lin_vel
+                tan_a = ((center_y - Table.player_width / 2) - self.pos_y) / (self.pos_x - ((center_x) + Table.player_thickness / 2))
+                self.pos_x = + (center_x + Table.player_thickness / 2) + (Table.ball_radius + 1) / (sqrt(1 + tan_a**2))
+                self.pos_y = ((center_x + Table.player_thickness / 2) - self.pos_x) * tan_a + (center_y - Table.player_width / 2)
+                opponent.brain.hit_ball = True
+                self.last_player_touched = opponent.opponent_num
+
+        elif (self.pos_x >= center_x + Table.player_thickness / 2) and (self.pos_y >= center_y + Table.player_width / 2):  # Lower right corner
+            if get_dist(self.pos_x, self.pos_y, center_x + Table.player_thickness / 2, center_y + Table.player_width / 2) <= Table.ball_radius:  # Collisions
+                x = self.pos_x - (center_x + Table.player_thickness / 2)
+                y = self.pos_y - (center_y + Table.player_width / 2)
+                c = - 2 * (self.vel_x * x + self.vel_y * y) / (x**2 + y**2)
+                self.vel_x = (self.vel_x + c * x) * Table.player_hit_cin_energy_efficiency + stick.rot_vel * Table.player_height
+                self.vel_y = (self.vel_y + c * y) * Table.player_hit_cin_energy_efficiency + stick.lin_vel
+                tan_a = (self.pos_y - (center_y + Table.player_width / 2)) / (self.pos_x - ((center_x) + Table.player_thickness / 2))
+                self.pos_x = + (center_x + Table.player_thickness / 2) + (Table.ball_radius + 1) / (sqrt(1 + tan_a**2))
+                self.pos_y = (self.pos_x - (center_x + Table.player_thickness / 2)) * tan_a + (center_y + Table.player_width / 2)
+                opponent.brain.hit_ball = True
+                self.last_player_touched = opponent.opponent_num
+
     def update(self):
         self.vel_x += self.acc_x
         self.vel_y += self.acc_y
@@ -378,15 +528,35 @@ class Ball:
         self.pos_x += self.vel_x
         self.pos_y += self.vel_y
 
-        self.check_collision()
-
-    def draw(self):
-        pygame.draw.circle(screen, Table.ball_color, (int(round(self.pos_x)), int(round(self.pos_y))), Table.ball_radius, 0)
+    def advance(self, frames):
+        # Roll the ball frames frames ahead at once, as that many update() calls without collisions would. For short
+        # jumps the update() calls are cheaper than glide()
+        if frames <= glide_frames:
+            for frame in range(frames):
+                self.update()
+            return
+        self.pos_x, self.vel_x = glide(self.pos_x, self.vel_x, frames)
+        self.pos_y, self.vel_y = glide(self.pos_y, self.vel_y, frames)
+
+    def free_frames(self, speed_x, speed_y, limit):
+        # Frames, up to limit, for which the ball can't touch an edge (or score) when it moves by at most the given
+        # speeds per frame, along each axis in the direction of its velocity
+        frames = limit
+        if self.vel_x > 0:
+            frames = frames_before(Table.length - Table.ball_radius - self.pos_x, speed_x, frames)
+        elif self.vel_x < 0:
+            frames = frames_before(self.pos_x - Table.ball_radius, speed_x, frames)
+        if self.vel_y > 0:
+            frames = frames_before(Table.width - Table.ball_radius - self.pos_y, speed_y, frames)
+        elif self.vel_y < 0:
+            frames = frames_before(self.pos_y - Table.ball_radius, speed_y, frames)
+        return frames
 
 
 class Game:
 
-    def __init__(self):
+    def __init__(self, seed=None):
+        self.random = Random(seed)  # Every game draws its kick-offs from its own generator, see game_seeds()
         self.game_over = False
         self.max_score = 0
         self.best_player = 0
@@ -398,39 +568,147 @@ class Game:
         self.game_num = 0
         for i in range(2):
             self.opponents.append(Opponent(i, self))
-
-    def draw_all(self):
-        # Draw all sticks and foosmen
-        for op in self.opponents:
-            op.draw()
-
-        self.ball.draw()
+        # Sticks in the order each opponent sees them, own sticks first
+        self.observed_sticks = (self.opponents[0].sticks + self.opponents[1].sticks,
+                                self.opponents[1].sticks + self.opponents[0].sticks)
+        # The sticks stand in lanes at every ninth of the table length, lanes[i] is the stick at (i + 1) / 9 of it
+        self.lanes = sorted(self.observed_sticks[0], key=lambda stick: stick.pos_x)
+
+    def snapshot(self):
+        # Copies of just the raw positions drawing the game needs, so that it can be drawn while the simulation keeps
+        # running. Anything derived from them, like the collision boxes, is left to the render thread
+        return {"ball": (self.ball.pos_x, self.ball.pos_y),
+                "sticks": [(stick.pos_x, stick.players, stick.color, stick.lin_pos, stick.rot_pos)
+                           for op in self.opponents for stick in op.sticks],
+                "game_over": self.game_over}
+
+    def get_results(self):
+        # Everything the fitness calculation needs to know about a finished game
+        return {"score": (self.opponents[0].score, self.opponents[1].score),
+                "own_goals": (self.opponents[0].own_goals, self.opponents[1].own_goals),
+                "current_frame": self.current_frame,
+                "hit_ball": (self.opponents[0].brain.hit_ball, self.opponents[1].brain.hit_ball),
+                "scored": (self.opponents[0].brain.scored, self.opponents[1].brain.scored)}
+
+    def fill_inputs(self, opponent_num, buffer):
+        # Write the brain inputs from the point of view of the given opponent, the table is mirrored for player 2, into
+        # the first 36 entries of buffer in place: 4 values for each own stick, then for each stick of the other
+        # opponent, then the ball. The one place the input layout is defined, for the per-brain and the batched path
+        max_lin_vel = Table.player_max_lin_vel
+        max_rot_vel = Table.player_max_rot_vel
+        i = 0
+        for stick in self.observed_sticks[opponent_num]:
+            buffer[i] = stick.lin_pos / stick.lin_range
+            buffer[i + 1] = stick.lin_vel / max_lin_vel
+            buffer[i + 2] = stick.rot_pos / pi
+            buffer[i + 3] = stick.rot_vel / max_rot_vel
+            i += 4
+        ball = self.ball
+        direction = 1 if opponent_num == 0 else -1
+        buffer[i] = direction * (ball.pos_x - Table.length / 2) / (Table.length / 2)
+        buffer[i + 1] = direction * ball.vel_x / Table.ball_max_vel
+        buffer[i + 2] = (ball.pos_y - Table.width / 2) / (Table.width / 2)
+        buffer[i + 3] = ball.vel_y / Table.ball_max_vel
+        # inputs.append(Table.player_height / Table.length)
+        # inputs.append(Table.player_width / Table.width)
+        # inputs.append(Table.player_thickness / Table.length)
+        # inputs.append(Table.player_angle_hit_limit / pi)
+        # inputs.append(Table.ball_radius / Table.length)
+
+    def apply_outputs(self, opponent_num, outputs, start=0):
+        # Brain outputs are (linear, rotational) acceleration pairs for the keeper, defence, middle and attack sticks,
+        # read from outputs[start:start + action_size]
+        for stick in self.opponents[opponent_num].sticks:
+            stick.lin_acc = outputs[start] * Table.key_lin_acc
+            stick.rot_acc = outputs[start + 1] * Table.key_rot_acc
+            start += 2
+
+    def update_brains(self, timer=None):
+        # Feed both brains their (mirrored) view of the table and apply the outputs as stick accelerations. The view is
+        # written straight into the brain's input nodes and the outputs are read from its output nodes, so no lists
+        # are built on the way
+        for opponent_num in range(2):
+            brain = self.opponents[opponent_num].brain
+            if timer is not None:
+                timer.switch("observe")
+            self.fill_inputs(opponent_num, brain.input_buffer())
+            if timer is not None:
+                timer.switch("infer")
+            brain.feed_forward()
+            if timer is not None:
+                timer.switch("act")
+            self.apply_outputs(opponent_num, brain.node_values, brain.input_nodes)
 
     def update_all(self):
-        self.current_frame += 1
-        if not self.game_over:
-            # Update velocities, positions and rotation angles
-            for op in self.opponents:
-                op.update()
+        self.update_physics()
+        self.update_collisions()
 
-            self.ball.update()
-
-            if self.opponents[0].score > self.opponents[1].score:
-                self.max_score = self.opponents[0].score
-                self.best_player = 0
-            else:
-                self.max_score = self.opponents[1].score
-                self.best_player = 1
+    def update_physics(self):
+        if self.game_over:  # The frame counter stops with the game, calc_all_fitness() takes the generation's longest
+            return
 
-            if self.max_score >= Table.max_score:
-                self.game_over = True
+        self.current_frame += 1
 
-            pygame.draw.rect(screen, Table.goal_color,
-                             (0, Table.width / 2 - Table.goal_width / 2, Table.goal_thickness, Table.goal_width),
-                             Table.goal_border)  # Draw goal 1
-            pygame.draw.rect(screen, Table.goal_color, (
-            Table.length - Table.goal_thickness, Table.width / 2 - Table.goal_width / 2, Table.goal_thickness,
-            Table.goal_width), Table.goal_border)  # Draw goal 2
+        # Update velocities, positions and rotation angles
+        for op in self.opponents:
+            op.update()
+
+        self.ball.update()
+
+    def fast_forward(self, limit):
+        # Skip ahead up to limit frames at once while the ball rolls freely: no foosman can touch it, it touches no
+        # edge and the game can't end. Whether that holds is decided from bounds on how far the ball and the sticks
+        # can move. The ball is then moved in closed form by Ball.advance(), the same as playing the frames one by one
+        # up to a fraction of a pixel, and the sticks are stepped exactly by PlayerStick.advance(). Returns the number
+        # of frames skipped
+        if self.game_over:
+            return 0
+        limit = min(limit, self.last_goal_frame + Table.max_frames_no_goals - self.current_frame - 1,
+                    Table.max_game_frames - self.current_frame - 1)
+        if limit < min_jump:
+            return 0
+
+        ball = self.ball
+        speed_x = roll_speed(ball.vel_x, limit)
+        speed_y = roll_speed(ball.vel_y, limit)
+        frames = ball.free_frames(speed_x, speed_y, limit)
+        if frames < min_jump:
+            return 0
+
+        # Only the sticks in the lanes the ball can get within reach of in that many frames can stop the jump
+        low = ball.pos_x - hit_reach_x
+        high = ball.pos_x + hit_reach_x
+        if ball.vel_x < 0:
+            low -= frames * speed_x
+        else:
+            high += frames * speed_x
+        for stick in self.lanes[max(int(ceil(low * 9 / Table.length)), 1) - 1:min(int(high * 9 / Table.length), 8)]:
+            frames = stick.safe_frames(ball, speed_x, speed_y, frames)
+            if frames < min_jump:
+                return 0
+
+        ball.advance(frames)
+        for stick in self.observed_sticks[0]:
+            stick.advance(frames)
+        self.current_frame += frames
+        return frames
+
+    def update_collisions(self):
+        # Second half of a frame: ball against foosmen, edges and goals, then whether the game is over
+        if self.game_over:
+            return
+
+        self.ball.check_collision()
+
+        if self.opponents[0].score > self.opponents[1].score:
+            self.max_score = self.opponents[0].score
+            self.best_player = 0
+        else:
+            self.max_score = self.opponents[1].score
+            self.best_player = 1
+
+        if self.max_score >= Table.max_score:
+            self.game_over = True
 
         if self.current_frame - self.last_goal_frame >= Table.max_frames_no_goals:  # End game after certain number of frames without goals
             self.game_over = True
@@ -438,340 +716,743 @@ class Game:
             self.game_over = True
 
 
-def run_all_games_single_window(games):
-    global active_game
-    global show_all_games
-
+def update_all_brains(games, brain_batch=None, buffers=None, action_repeat=1, timer=None):
+    # Let every brain of every running game react to the current frame, either one brain at a time or, with a
+    # BrainBatch over the brains of all games (two rows per game) and the buffers of make_brain_batch(), in a single
+    # vectorized call
+    # With an action_repeat of N the brains only decide on every Nth frame of their game, the stick accelerations
+    # they set stay in force until their next decision
+    if timer is not None:  # Also on frames where no game decides, so that checking for them isn't charged to collision
+        timer.switch("observe")
+    if brain_batch is None:
+        for game in games:
+            if not game.game_over and game.current_frame % action_repeat == 0:
+                game.update_brains(timer)
+    else:
+        deciding = buffers["deciding"]
+        rows = buffers["rows"]
+        any_deciding = False
+        for i, game in enumerate(games):
+            deciding[i] = decides = not game.game_over and game.current_frame % action_repeat == 0
+            if decides:
+                any_deciding = True
+                game.fill_inputs(0, rows[2 * i])
+                game.fill_inputs(1, rows[2 * i + 1])
+        if not any_deciding:
+            return
+        if timer is not None:
+            timer.switch("infer")
+        brain_batch.feed_forward(buffers["observations"], buffers["outputs"])
+        if timer is not None:
+            timer.switch("act")
+        outputs = buffers["output_values"]
+        for i, game in enumerate(games):
+            if deciding[i]:
+                game.apply_outputs(0, outputs, 2 * i * action_size)
+                game.apply_outputs(1, outputs, (2 * i + 1) * action_size)
+
+
+def make_brain_batch(games):
+    # The BrainBatch of all brains of games, and the buffers update_all_brains() reuses every frame: observations
+    # is filled row by row in place through rows, and outputs is read through output_values, whose items are Python
+    # floats like those of a list, so the sticks don't get slow numpy scalars
+    brains = []
+    for game in games:
+        brains.append(game.opponents[0].brain)
+        brains.append(game.opponents[1].brain)
+    brain_batch = BrainBatch(brains)
+    observations = np.zeros((len(brains), brain_batch.input_nodes))
+    outputs = np.zeros((len(brains), brain_batch.output_nodes))
+    return brain_batch, {"observations": observations,
+                         "rows": [memoryview(row) for row in observations],
+                         "deciding": [False] * len(games),
+                         "outputs": outputs,
+                         "output_values": memoryview(outputs).cast("B").cast("d")}
+
+
+def run_all_games_headless(games, batched=False, action_repeat=1, fast_forward=False, timer=None, exchange=None):
+    # Same lockstep simulation as run_all_games_single_window, minus event polling, drawing and frame rate throttling
+    # Returns the number of game frames that were simulated
+    # A SnapshotExchange is handed a snapshot of the games after every frame in which its render thread wants one
+    # With fast_forward, games whose ball flies freely skip ahead to just before the next decision of their brains, so
+    # the games no longer run in lockstep. A skip saves the collision checks and, for long ones, the stepping of the
+    # ball, but the sticks are still stepped frame by frame, so it only takes a few percent off
+    brain_batch, buffers = make_brain_batch(games) if batched else (None, None)
+    frames = 0
     all_games_done = False
 
-    last_framerate_update = datetime.now()
-    recent_frametimes = []
+    while not all_games_done:
+        if timer is not None:
+            timer.frame()
+        update_all_brains(games, brain_batch, buffers, action_repeat, timer)
 
-    frame_start_timestamp = datetime.now()
-
-    while True and not all_games_done:
+        if fast_forward and action_repeat > 1:
+            if timer is not None:
+                timer.switch("fast_forward")
+            for game in games:
+                frames += game.fast_forward(action_repeat - 1 - game.current_frame % action_repeat)
 
+        # Games don't interact, so all games can move before any of them collides, which lets the two be timed apart
+        if timer is not None:
+            timer.switch("physics")
         for game in games:
+            game.update_physics()
 
+        if timer is not None:
+            timer.switch("collision")
+        all_games_done = True
+        for game in games:
             if not game.game_over:
+                frames += 1
+            game.update_collisions()
+            all_games_done = all_games_done and game.game_over
 
-                # print(str(game.game_num))
-                opponent = game.opponents[0]
-                inputs0 = []
-                for stick in opponent.sticks:
-                    inputs0.append(stick.lin_pos / stick.lin_range)
-                    inputs0.append(stick.lin_vel / Table.player_max_lin_vel)
-                    inputs0.append(stick.rot_pos / pi)
-                    inputs0.append(stick.rot_vel / Table.player_max_rot_vel)
-                for stick in game.opponents[1].sticks:
-                    inputs0.append(stick.lin_pos / stick.lin_range)
-                    inputs0.append(stick.lin_vel / Table.player_max_lin_vel)
-                    inputs0.append(stick.rot_pos / pi)
-                    inputs0.append(stick.rot_vel / Table.player_max_rot_vel)
-                inputs0.append((game.ball.pos_x - Table.length / 2) / (Table.length / 2))
-                inputs0.append(game.ball.vel_x / Table.ball_max_vel)
-                inputs0.append((game.ball.pos_y - Table.width / 2) / (Table.width / 2))
-                inputs0.append(game.ball.vel_y / Table.ball_max_vel)
-                # inputs0.append(Table.player_height / Table.length)
-                # inputs0.append(Table.player_width / Table.width)
-                # inputs0.append(Table.player_thickness / Table.length)
-                # inputs0.append(Table.player_angle_hit_limit / pi)
-                # inputs0.append(Table.ball_radius / Table.length)
-
-                game.opponents[0].brain.put_input(inputs0)
-                game.opponents[0].brain.feed_forward()
-                outputs0 = game.opponents[0].brain.get_outputs()
-
-                opponent = game.opponents[1]
-                inputs1 = []
-                for stick in opponent.sticks:
-                    inputs1.append(stick.lin_pos / stick.lin_range)
-                    inputs1.append(stick.lin_vel / Table.player_max_lin_vel)
-                    inputs1.append(stick.rot_pos / pi)
-                    inputs1.append(stick.rot_vel / Table.player_max_rot_vel)
-                for stick in game.opponents[0].sticks:
-                    inputs1.append(stick.lin_pos / stick.lin_range)
-                    inputs1.append(stick.lin_vel / Table.player_max_lin_vel)
-                    inputs1.append(stick.rot_pos / pi)
-                    inputs1.append(stick.rot_vel / Table.player_max_rot_vel)
-                inputs1.append(- (game.ball.pos_x - Table.length / 2) / (Table.length / 2))
-                inputs1.append(- game.ball.vel_x / Table.ball_max_vel)
-                inputs1.append((game.ball.pos_y - Table.width / 2) / (Table.width / 2))
-                inputs1.append(game.ball.vel_y / Table.ball_max_vel)
-                # inputs1.append(Table.player_height / Table.length)
-                # inputs1.append(Table.player_width / Table.width)
-                # inputs1.append(Table.player_thickness / Table.length)
-                # inputs1.append(Table.player_angle_hit_limit / pi)
-                # inputs1.append(Table.ball_radius / Table.length)
-
-                game.opponents[1].brain.put_input(inputs1)
-                game.opponents[1].brain.feed_forward()
-                outputs1 = game.opponents[1].brain.get_outputs()
-
-                # print(outputs0)
-
-                game.opponents[0].sticks[0].lin_acc = outputs0[0] * Table.key_lin_acc
-                game.opponents[0].sticks[0].rot_acc = outputs0[1] * Table.key_rot_acc
-                game.opponents[0].sticks[1].lin_acc = outputs0[2] * Table.key_lin_acc
-                game.opponents[0].sticks[1].rot_acc = outputs0[3] * Table.key_rot_acc
-                game.opponents[0].sticks[2].lin_acc = outputs0[4] * Table.key_lin_acc
-                game.opponents[0].sticks[2].rot_acc = outputs0[5] * Table.key_rot_acc
-                game.opponents[0].sticks[3].lin_acc = outputs0[6] * Table.key_lin_acc
-                game.opponents[0].sticks[3].rot_acc = outputs0[7] * Table.key_rot_acc
-
-                # print(outputs1)
-
-                game.opponents[1].sticks[0].lin_acc = outputs1[0] * Table.key_lin_acc
-                game.opponents[1].sticks[0].rot_acc = outputs1[1] * Table.key_rot_acc
-                game.opponents[1].sticks[1].lin_acc = outputs1[2] * Table.key_lin_acc
-                game.opponents[1].sticks[1].rot_acc = outputs1[3] * Table.key_rot_acc
-                game.opponents[1].sticks[2].lin_acc = outputs1[4] * Table.key_lin_acc
-                game.opponents[1].sticks[2].rot_acc = outputs1[5] * Table.key_rot_acc
-                game.opponents[1].sticks[3].lin_acc = outputs1[6] * Table.key_lin_acc
-                game.opponents[1].sticks[3].rot_acc = outputs1[7] * Table.key_rot_acc
+        if exchange is not None and exchange.wanted:
+            exchange.take(games, frames)
 
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                exit(0)
-
-                # Controls: pressing and holding various keys subjects the sticks to acceleration, both for shifting
-                # and for rotating
-                # Releasing the key will instantly stop the current translation or rotation
-
-            if event.type == pygame.KEYDOWN:
-
-                # Player 1 controls
-
-                if event.key == pygame.K_s:
-                    games[active_game].opponents[0].sticks[0].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_x:
-                    games[active_game].opponents[0].sticks[0].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_z:
-                    games[active_game].opponents[0].sticks[0].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_c:
-                    games[active_game].opponents[0].sticks[0].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_g:
-                    games[active_game].opponents[0].sticks[1].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_b:
-                    games[active_game].opponents[0].sticks[1].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_v:
-                    games[active_game].opponents[0].sticks[1].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_n:
-                    games[active_game].opponents[0].sticks[1].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_k:
-                    games[active_game].opponents[0].sticks[2].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_COMMA:
-                    games[active_game].opponents[0].sticks[2].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_m:
-                    games[active_game].opponents[0].sticks[2].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_PERIOD:
-                    games[active_game].opponents[0].sticks[2].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_UP:
-                    games[active_game].opponents[0].sticks[3].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_DOWN:
-                    games[active_game].opponents[0].sticks[3].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_LEFT:
-                    games[active_game].opponents[0].sticks[3].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_RIGHT:
-                    games[active_game].opponents[0].sticks[3].rot_acc = Table.key_rot_acc
-
-                    # Player 2 controls
-
-                if event.key == pygame.K_2:
-                    games[active_game].opponents[1].sticks[3].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_w:
-                    games[active_game].opponents[1].sticks[3].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_q:
-                    games[active_game].opponents[1].sticks[3].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_e:
-                    games[active_game].opponents[1].sticks[3].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_5:
-                    games[active_game].opponents[1].sticks[2].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_t:
-                    games[active_game].opponents[1].sticks[2].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_r:
-                    games[active_game].opponents[1].sticks[2].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_y:
-                    games[active_game].opponents[1].sticks[2].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_8:
-                    games[active_game].opponents[1].sticks[1].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_i:
-                    games[active_game].opponents[1].sticks[1].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_u:
-                    games[active_game].opponents[1].sticks[1].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_o:
-                    games[active_game].opponents[1].sticks[1].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_MINUS:
-                    games[active_game].opponents[1].sticks[0].lin_acc = -Table.key_lin_acc
-                elif event.key == pygame.K_LEFTBRACKET:
-                    games[active_game].opponents[1].sticks[0].lin_acc = Table.key_lin_acc
-                if event.key == pygame.K_p:
-                    games[active_game].opponents[1].sticks[0].rot_acc = -Table.key_rot_acc
-                elif event.key == pygame.K_RIGHTBRACKET:
-                    games[active_game].opponents[1].sticks[0].rot_acc = Table.key_rot_acc
-
-                if event.key == pygame.K_1:
-                    active_game -= 1
-                    active_game %= len(games)
-                elif event.key == pygame.K_3:
-                    active_game += 1
-                    active_game %= len(games)
-                if event.key == pygame.K_RETURN:
-                    show_all_games = not show_all_games
-
-            if event.type == pygame.KEYUP:
-
-                # Player 1 controls
-
-                if event.key == pygame.K_s or event.key == pygame.K_x:
-                    games[active_game].opponents[0].sticks[0].lin_acc = 0
-                    games[active_game].opponents[0].sticks[0].lin_vel = 0
-                if event.key == pygame.K_z or event.key == pygame.K_c:
-                    games[active_game].opponents[0].sticks[0].rot_acc = 0
-                    games[active_game].opponents[0].sticks[0].rot_vel = 0
-
-                if event.key == pygame.K_g or event.key == pygame.K_b:
-                    games[active_game].opponents[0].sticks[1].lin_acc = 0
-                    games[active_game].opponents[0].sticks[1].lin_vel = 0
-                if event.key == pygame.K_v or event.key == pygame.K_n:
-                    games[active_game].opponents[0].sticks[1].rot_acc = 0
-                    games[active_game].opponents[0].sticks[1].rot_vel = 0
-
-                if event.key == pygame.K_k or event.key == pygame.K_COMMA:
-                    games[active_game].opponents[0].sticks[2].lin_acc = 0
-                    games[active_game].opponents[0].sticks[2].lin_vel = 0
-                if event.key == pygame.K_m or event.key == pygame.K_PERIOD:
-                    games[active_game].opponents[0].sticks[2].rot_acc = 0
-                    games[active_game].opponents[0].sticks[2].rot_vel = 0
-
-                if event.key == pygame.K_UP or event.key == pygame.K_DOWN:
-                    games[active_game].opponents[0].sticks[3].lin_acc = 0
-                    games[active_game].opponents[0].sticks[3].lin_vel = 0
-                if event.key == pygame.K_LEFT or event.key == pygame.K_RIGHT:
-                    games[active_game].opponents[0].sticks[3].rot_acc = 0
-                    games[active_game].opponents[0].sticks[3].rot_vel = 0
-
-                    # Player 2 controls
-
-                if event.key == pygame.K_2 or event.key == pygame.K_w:
-                    games[active_game].opponents[1].sticks[3].lin_acc = 0
-                    games[active_game].opponents[1].sticks[3].lin_vel = 0
-                if event.key == pygame.K_q or event.key == pygame.K_e:
-                    games[active_game].opponents[1].sticks[3].rot_acc = 0
-                    games[active_game].opponents[1].sticks[3].rot_vel = 0
-
-                if event.key == pygame.K_5 or event.key == pygame.K_t:
-                    games[active_game].opponents[1].sticks[2].lin_acc = 0
-                    games[active_game].opponents[1].sticks[2].lin_vel = 0
-                if event.key == pygame.K_r or event.key == pygame.K_y:
-                    games[active_game].opponents[1].sticks[2].rot_acc = 0
-                    games[active_game].opponents[1].sticks[2].rot_vel = 0
-
-                if event.key == pygame.K_8 or event.key == pygame.K_i:
-                    games[active_game].opponents[1].sticks[1].lin_acc = 0
-                    games[active_game].opponents[1].sticks[1].lin_vel = 0
-                if event.key == pygame.K_u or event.key == pygame.K_o:
-                    games[active_game].opponents[1].sticks[1].rot_acc = 0
-                    games[active_game].opponents[1].sticks[1].rot_vel = 0
-
-                if event.key == pygame.K_MINUS or event.key == pygame.K_LEFTBRACKET:
-                    games[active_game].opponents[1].sticks[0].lin_acc = 0
-                    games[active_game].opponents[1].sticks[0].lin_vel = 0
-                if event.key == pygame.K_p or event.key == pygame.K_RIGHTBRACKET:
-                    games[active_game].opponents[1].sticks[0].rot_acc = 0
-                    games[active_game].opponents[1].sticks[0].rot_vel = 0
+    if timer is not None:
+        timer.stop()
+    return frames
 
-        all_games_done = True
 
-        screen.fill(0)
+def game_seeds(run_seed, gen, count):
+    # Kick-off seeds for every game of a generation, only depending on the run seed, the generation and the game index
+    seed_random = Random("%d-%d" % (run_seed, gen))
+    return [seed_random.getrandbits(64) for i in range(count)]
 
-        for game in games:  # Run all games
-            game.update_all()
-            if show_all_games:
-                game.draw_all()
-            all_games_done = all_games_done and game.game_over
 
-        if not show_all_games:
-            games[active_game].draw_all()
-            if games[active_game].game_over:
-                games_still_running = 0
-                for game in games:
-                    if not game.game_over:
-                        games_still_running += 1
-                textsurface = myfont.render('Game over. Running %d/%d games in background...' % (games_still_running, len(games)), False, Table.game_over_text_color)
-                screen.blit(textsurface, (Table.length / 2 - textsurface.get_width() / 2, Table.width / 2 - textsurface.get_height() / 2))
-
-        pygame.display.flip()
-
-        now = datetime.now()
-        if (now - frame_start_timestamp).total_seconds() < 1 / max_frame_rate:
-            sleep_time = 1 / max_frame_rate - (now - frame_start_timestamp).total_seconds()
-            sleep(sleep_time)
+def matchup_seeds(run_seed, brain_pairs):
+    # Kick-off seeds that only depend on the run seed and the genomes of the two brains, so that a matchup that comes
+    # up again in a later generation is exactly the same game and can be answered by a ResultCache
+    return [Random("%d-%s-%s" % (run_seed, brain0.genome_hash(), brain1.genome_hash())).getrandbits(64)
+            for brain0, brain1 in brain_pairs]
 
-        frame_end_timestamp = datetime.now()
-        frametime = (frame_end_timestamp - frame_start_timestamp).total_seconds()
-        recent_frametimes.append(frametime)
-        if (frame_end_timestamp - last_framerate_update).total_seconds() >= 0.5:
-            last_framerate_update = datetime.now()
-            average_frametime = sum(recent_frametimes) / len(recent_frametimes)
-            recent_frametimes = []
-            pygame.display.set_caption("Player 1: %d                Player 2: %d              Active Game: %d                    Framerate: %f" % (games[active_game].opponents[0].score, games[active_game].opponents[1].score, active_game, 1 / average_frametime))
 
-        frame_start_timestamp = datetime.now()
-        
+class ResultCache:
+    # Results of played games keyed on (genome hash of player 1, genome hash of player 2, kick-off seed). A game is
+    # fully determined by these as long as the simulation settings stay the same, which they do within a run. The
+    # least recently used results are dropped beyond max_size
 
-environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % (0, 30)
-pygame.init()
-screen = pygame.display.set_mode((Table.length, Table.width))
-pygame.font.init()
-myfont = pygame.font.SysFont(Table.game_over_text_font, Table.game_over_text_size)
-screen.fill(0)
+    max_size = 100000
 
-if len(argv) >= 2:
-    currentPop = Population(argv[1])  # Load existing population
-else:
-    currentPop = Population()  # New population
-# print(currentPop.all_nets)
-currentPop.save_to_file()
+    def __init__(self):
+        self.results = {}
+        self.hits = 0  # Games served from the cache, since the last reset_counts()
+        self.lookups = 0
+
+    def reset_counts(self):
+        self.hits = 0
+        self.lookups = 0
+
+    def evaluate(self, brain_pairs, seeds, evaluate):
+        # Results of all games like evaluate(brain_pairs, seeds) returns them, only playing the games that are neither
+        # in the cache nor a repeat of an earlier game in the list. Returns the results and the simulated frames
+        keys = [(brain0.genome_hash(), brain1.genome_hash(), game_seed)
+                for (brain0, brain1), game_seed in zip(brain_pairs, seeds)]
+        self.lookups += len(keys)
+
+        to_play = {}  # Key -> index of the first game with it that has to be played
+        for i, key in enumerate(keys):
+            if key in self.results:
+                self.results[key] = self.results.pop(key)  # Most recently used go last
+            elif key not in to_play:
+                to_play[key] = i
+
+        frames = 0
+        if to_play:
+            indices = list(to_play.values())
+            played, frames = evaluate([brain_pairs[i] for i in indices], [seeds[i] for i in indices])
+            for i, result in zip(indices, played):
+                self.results[keys[i]] = result
+
+        results = [self.results[key] for key in keys]
+        while len(self.results) > self.max_size:
+            del self.results[next(iter(self.results))]
+        self.hits += len(keys) - len(to_play)
+        return results, frames
+
+
+def make_games(brain_pairs, seeds):
+    games = []  # New array of games to be played
+    for i, ((brain0, brain1), game_seed) in enumerate(zip(brain_pairs, seeds)):
+        new_game = Game(game_seed)
+        new_game.opponents[0].brain = brain0
+        new_game.opponents[1].brain = brain1
+        new_game.game_num = 2 * i
+        games.append(new_game)
+    return games
 
-while True:
 
-    games = []  # New array of games to be played
+def play_games(brain_pairs, seeds, backend="game", batched=False, action_repeat=1, fast_forward=False, timer=None):
+    # Play one headless game per pair of brains, returns the results and the number of simulated game frames
+    # This is also what the worker processes of evaluate_games() run on their share of the games
+    if backend == "vector":
+        from vectorgame import run_vector_games  # vectorgame imports this module, so it can't be imported on top
+        return run_vector_games(brain_pairs, seeds, action_repeat, timer)
 
-    for i in range(0, Population.size, 2):
-        new_game = Game()
-        new_game.opponents[0].brain = currentPop.all_nets[i]
-        new_game.opponents[1].brain = currentPop.all_nets[i + 1]
-        new_game.game_num = i
-        games.append(new_game)
+    games = make_games(brain_pairs, seeds)
+    frames = run_all_games_headless(games, batched, action_repeat, fast_forward, timer)
+    return [game.get_results() for game in games], frames
 
-    run_all_games_single_window(games)
 
-    for game in games:
-        fitness0 = game.opponents[0].brain.fitness
-        fitness1 = game.opponents[1].brain.fitness
+def evaluate_games(brain_pairs, seeds, pool=None, workers=1, backend="game", batched=False, action_repeat=1,
+                   fast_forward=False, timer=None):
+    # Play all games headless, split into one contiguous shard per worker process when a pool is given. Since every
+    # game has its own seed and frame counter, the results don't depend on how the games are split up
+    # The frame phases are only timed when the games are played in this process
+    if pool is None:
+        return play_games(brain_pairs, seeds, backend, batched, action_repeat, fast_forward, timer)
+
+    shard_size = -(-len(brain_pairs) // workers)
+    shards = []
+    for start in range(0, len(brain_pairs), shard_size):
+        shards.append((brain_pairs[start:start + shard_size], seeds[start:start + shard_size], backend, batched,
+                       action_repeat, fast_forward))
 
-        player0_goal_argument = Table.goal_argument_coeff * (game.opponents[0].score - game.opponents[0].own_goals - game.opponents[1].score + 2 * Table.max_score) / (3 * Table.max_score)
-        player0_duration_argument = Table.duration_argument_coeff * (Table.max_game_frames - game.current_frame) / Table.max_game_frames
-        player0_opponent_fitness_argument = Table.opponent_fitness_argument_coeff * (fitness1 / currentPop.best_fitness)
+    results = []
+    frames = 0
+    for shard_results, shard_frames in pool.starmap(play_games, shards):
+        results.extend(shard_results)
+        frames += shard_frames
+    return results, frames
 
-        player1_goal_argument = Table.goal_argument_coeff * (game.opponents[1].score - game.opponents[1].own_goals - game.opponents[0].score + 2 * Table.max_score) / (3 * Table.max_score)
-        player1_duration_argument = Table.duration_argument_coeff * (Table.max_game_frames - game.current_frame) / Table.max_game_frames
-        player1_opponent_fitness_argument = Table.opponent_fitness_argument_coeff * (fitness0 / currentPop.best_fitness)
 
-        game.opponents[0].brain.calc_fitness([player0_goal_argument, player0_duration_argument, player0_opponent_fitness_argument])
-        game.opponents[1].brain.calc_fitness([player1_goal_argument, player1_duration_argument, player1_opponent_fitness_argument])
+def handle_event(event, games):
+    # Window close, the keyboard controls of the active game and switching which games are shown
+    global active_game
+    global show_all_games
+
+    if event.type == pygame.QUIT:
+        pygame.quit()
+        exit(0)
+
+        # Controls: pressing and holding various keys subjects the sticks to acceleration, both for shifting
+        # and for rotating
+        # Releasing the key will instantly stop the current translation or rotation
+
+    if event.type == pygame.KEYDOWN:
+
+        # Player 1 controls
+
+        if event.key == pygame.K_s:
+            games[active_game].opponents[0].sticks[0].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_x:
+            games[active_game].opponents[0].sticks[0].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_z:
+            games[active_game].opponents[0].sticks[0].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_c:
+            games[active_game].opponents[0].sticks[0].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_g:
+            games[active_game].opponents[0].sticks[1].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_b:
+            games[active_game].opponents[0].sticks[1].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_v:
+            games[active_game].opponents[0].sticks[1].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_n:
+            games[active_game].opponents[0].sticks[1].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_k:
+            games[active_game].opponents[0].sticks[2].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_COMMA:
+            games[active_game].opponents[0].sticks[2].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_m:
+            games[active_game].opponents[0].sticks[2].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_PERIOD:
+            games[active_game].opponents[0].sticks[2].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_UP:
+            games[active_game].opponents[0].sticks[3].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_DOWN:
+            games[active_game].opponents[0].sticks[3].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_LEFT:
+            games[active_game].opponents[0].sticks[3].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_RIGHT:
+            games[active_game].opponents[0].sticks[3].rot_acc = Table.key_rot_acc
+
+            # Player 2 controls
+
+        if event.key == pygame.K_2:
+            games[active_game].opponents[1].sticks[3].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_w:
+            games[active_game].opponents[1].sticks[3].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_q:
+            games[active_game].opponents[1].sticks[3].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_e:
+            games[active_game].opponents[1].sticks[3].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_5:
+            games[active_game].opponents[1].sticks[2].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_t:
+            games[active_game].opponents[1].sticks[2].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_r:
+            games[active_game].opponents[1].sticks[2].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_y:
+            games[active_game].opponents[1].sticks[2].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_8:
+            games[active_game].opponents[1].sticks[1].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_i:
+            games[active_game].opponents[1].sticks[1].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_u:
+            games[active_game].opponents[1].sticks[1].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_o:
+            games[active_game].opponents[1].sticks[1].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_MINUS:
+            games[active_game].opponents[1].sticks[0].lin_acc = -Table.key_lin_acc
+        elif event.key == pygame.K_LEFTBRACKET:
+            games[active_game].opponents[1].sticks[0].lin_acc = Table.key_lin_acc
+        if event.key == pygame.K_p:
+            games[active_game].opponents[1].sticks[0].rot_acc = -Table.key_rot_acc
+        elif event.key == pygame.K_RIGHTBRACKET:
+            games[active_game].opponents[1].sticks[0].rot_acc = Table.key_rot_acc
+
+        if event.key == pygame.K_1:
+            active_game -= 1
+            active_game %= len(games)
+        elif event.key == pygame.K_3:
+            active_game += 1
+            active_game %= len(games)
+        if event.key == pygame.K_RETURN:
+            show_all_games = not show_all_games
+
+    if event.type == pygame.KEYUP:
+
+        # Player 1 controls
+
+        if event.key == pygame.K_s or event.key == pygame.K_x:
+            games[active_game].opponents[0].sticks[0].lin_acc = 0
+            games[active_game].opponents[0].sticks[0].lin_vel = 0
+        if event.key == pygame.K_z or event.key == pygame.K_c:
+            games[active_game].opponents[0].sticks[0].rot_acc = 0
+            games[active_game].opponents[0].sticks[0].rot_vel = 0
+
+        if event.key == pygame.K_g or event.key == pygame.K_b:
+            games[active_game].opponents[0].sticks[1].lin_acc = 0
+            games[active_game].opponents[0].sticks[1].lin_vel = 0
+        if event.key == pygame.K_v or event.key == pygame.K_n:
+            games[active_game].opponents[0].sticks[1].rot_acc = 0
+            games[active_game].opponents[0].sticks[1].rot_vel = 0
+
+        if event.key == pygame.K_k or event.key == pygame.K_COMMA:
+            games[active_game].opponents[0].sticks[2].lin_acc = 0
+            games[active_game].opponents[0].sticks[2].lin_vel = 0
+        if event.key == pygame.K_m or event.key == pygame.K_PERIOD:
+            games[active_game].opponents[0].sticks[2].rot_acc = 0
+            games[active_game].opponents[0].sticks[2].rot_vel = 0
+
+        if event.key == pygame.K_UP or event.key == pygame.K_DOWN:
+            games[active_game].opponents[0].sticks[3].lin_acc = 0
+            games[active_game].opponents[0].sticks[3].lin_vel = 0
+        if event.key == pygame.K_LEFT or event.key == pygame.K_RIGHT:
+            games[active_game].opponents[0].sticks[3].rot_acc = 0
+            games[active_game].opponents[0].sticks[3].rot_vel = 0
+
+            # Player 2 controls
+
+        if event.key == pygame.K_2 or event.key == pygame.K_w:
+            games[active_game].opponents[1].sticks[3].lin_acc = 0
+            games[active_game].opponents[1].sticks[3].lin_vel = 0
+        if event.key == pygame.K_q or event.key == pygame.K_e:
+            games[active_game].opponents[1].sticks[3].rot_acc = 0
+            games[active_game].opponents[1].sticks[3].rot_vel = 0
+
+        if event.key == pygame.K_5 or event.key == pygame.K_t:
+            games[active_game].opponents[1].sticks[2].lin_acc = 0
+            games[active_game].opponents[1].sticks[2].lin_vel = 0
+        if event.key == pygame.K_r or event.key == pygame.K_y:
+            games[active_game].opponents[1].sticks[2].rot_acc = 0
+            games[active_game].opponents[1].sticks[2].rot_vel = 0
+
+        if event.key == pygame.K_8 or event.key == pygame.K_i:
+            games[active_game].opponents[1].sticks[1].lin_acc = 0
+            games[active_game].opponents[1].sticks[1].lin_vel = 0
+        if event.key == pygame.K_u or event.key == pygame.K_o:
+            games[active_game].opponents[1].sticks[1].rot_acc = 0
+            games[active_game].opponents[1].sticks[1].rot_vel = 0
+
+        if event.key == pygame.K_MINUS or event.key == pygame.K_LEFTBRACKET:
+            games[active_game].opponents[1].sticks[0].lin_acc = 0
+            games[active_game].opponents[1].sticks[0].lin_vel = 0
+        if event.key == pygame.K_p or event.key == pygame.K_RIGHTBRACKET:
+            games[active_game].opponents[1].sticks[0].rot_acc = 0
+            games[active_game].opponents[1].sticks[0].rot_vel = 0
+
+
+def take_snapshots(games):
+    # What one displayed frame shows: all games or only the active one, and how many games are still running
+    shown = games if show_all_games else [games[active_game]]
+    active = games[active_game].opponents
+    return {"games": [game.snapshot() for game in shown], "show_all_games": show_all_games,
+            "active_game": active_game, "active_score": (active[0].score, active[1].score),
+            "running": sum(not game.game_over for game in games), "total": len(games)}
+
+
+def draw_background(sticks):
+    # The goals and the stick rods never move, so they are drawn once for all games and frames and blitted from then on
+    global background
+
+    background = pygame.Surface((Table.length, Table.width))
+    background.fill(0)
+    pygame.draw.rect(background, Table.goal_color,
+                     (0, Table.width / 2 - Table.goal_width / 2, Table.goal_thickness, Table.goal_width),
+                     Table.goal_border)  # Draw goal 1
+    pygame.draw.rect(background, Table.goal_color, (
+    Table.length - Table.goal_thickness, Table.width / 2 - Table.goal_width / 2, Table.goal_thickness,
+    Table.goal_width), Table.goal_border)  # Draw goal 2
+    for pos_x, players, color, lin_pos, rot_pos in sticks:
+        pygame.draw.rect(background, Table.stick_color, (pos_x - Table.stick_width/2, 0, Table.stick_width, Table.width), Table.stick_border)  # draw the stick
+
+
+def draw_snapshot(snapshot):
+    # Draw all foosmen, taking into account their rotation angles, and the ball over the background
+    for pos_x, players, color, lin_pos, rot_pos in snapshot["sticks"]:
+        reach = int(round(Table.player_height / 2 * sin(rot_pos)))
+        left = pos_x - Table.player_thickness / 2 - reach
+        thickness = Table.player_thickness + int(round(Table.player_height * sin(rot_pos)))
+        for player in range(players):
+            pygame.draw.rect(screen, color, (left, ((player + 1)/(players + 1)) * Table.width - Table.player_width / 2 + lin_pos, thickness, Table.player_width), Table.player_border)
+
+    if Table.debug:  # The boxes Ball.check_collision() tests the ball against, from the snapshot's stick positions
+        for pos_x, players, color, lin_pos, rot_pos in snapshot["sticks"]:
+            if abs(rot_pos) < Table.player_angle_hit_limit:
+                collision_rect_x = pos_x + Table.player_height / 2 * sin(rot_pos)
+                for player in range(players):
+                    collision_rect_y = ((player + 1) / (players + 1)) * Table.width + lin_pos
+                    pygame.draw.rect(screen, Table.collision_box_color, (collision_rect_x - Table.player_thickness / 2, collision_rect_y - Table.player_width / 2, Table.player_thickness, Table.player_width), Table.collision_box_border)
+
+    ball_x, ball_y = snapshot["ball"]
+    pygame.draw.circle(screen, Table.ball_color, (int(round(ball_x)), int(round(ball_y))), Table.ball_radius, 0)
+
+
+def draw_snapshots(snapshots):
+    if background is None:
+        draw_background(snapshots["games"][0]["sticks"])
+    screen.blit(background, (0, 0))
+    for snapshot in snapshots["games"]:
+        draw_snapshot(snapshot)
+    if not snapshots["show_all_games"] and snapshots["games"][0]["game_over"]:
+        textsurface = myfont.render('Game over. Running %d/%d games in background...' % (snapshots["running"], snapshots["total"]), False, Table.game_over_text_color)
+        screen.blit(textsurface, (Table.length / 2 - textsurface.get_width() / 2, Table.width / 2 - textsurface.get_height() / 2))
+    pygame.display.flip()
+
+
+class SnapshotExchange:
+    # Hands snapshots from the simulation thread to the render thread. The render thread asks for a snapshot by
+    # setting wanted, and the simulation takes one after the next frame it finishes, so the simulation pays for one
+    # snapshot per displayed frame and for nothing in between, and the snapshot is never of a half simulated frame
 
-    currentPop.set_best_player()
+    def __init__(self):
+        self.wanted = True
+        self.snapshots = None
+        self.frames = 0  # Game frames simulated when the snapshot was taken
+
+    def take(self, games, frames):
+        self.snapshots = take_snapshots(games)
+        self.frames = frames
+        self.wanted = False
+
+
+def run_all_games_rendered(games, batched=False, action_repeat=1, fast_forward=False, render_rate=60, timer=None):
+    # The games run unthrottled in run_all_games_headless on a simulation thread, while this thread polls events and
+    # draws the latest snapshot render_rate times per second. Drawing, and how many games are drawn, no longer slows
+    # the simulation down; it only shares the interpreter with the render thread for the moments that takes
+    # The frame phases of timer only cover the simulation thread. Returns the number of simulated game frames
+    exchange = SnapshotExchange()
+    outcome = {}
+
+    def simulate():
+        try:
+            outcome["frames"] = run_all_games_headless(games, batched, action_repeat, fast_forward, timer, exchange)
+        except BaseException as error:
+            outcome["error"] = error
+
+    simulation = threading.Thread(target=simulate, name="simulation", daemon=True)
+    simulation.start()
+
+    last_caption_update = perf_counter()
+    last_caption_frames = 0
+    rendered = 0
+    while simulation.is_alive():
+        render_start = perf_counter()
+        for event in pygame.event.get():
+            handle_event(event, games)
+
+        snapshots = exchange.snapshots
+        if snapshots is not None:
+            draw_snapshots(snapshots)
+            rendered += 1
+        exchange.wanted = True
+
+        if render_start - last_caption_update >= 0.5 and snapshots is not None:
+            elapsed = render_start - last_caption_update
+            score = snapshots["active_score"]
+            pygame.display.set_caption("Player 1: %d                Player 2: %d              Active Game: %d                    Framerate: %f                    Simulation: %.0f frames/s" % (score[0], score[1], snapshots["active_game"], rendered / elapsed, (exchange.frames - last_caption_frames) / elapsed))
+            last_caption_update = render_start
+            last_caption_frames = exchange.frames
+            rendered = 0
+
+        remaining = 1 / render_rate - (perf_counter() - render_start)
+        if remaining > 0:
+            sleep(remaining)
+
+    simulation.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["frames"]
+
+
+def run_all_games_single_window(games, batched=False, action_repeat=1, timer=None):
+    brain_batch, buffers = make_brain_batch(games) if batched else (None, None)
+    all_games_done = False
+
+    last_framerate_update = perf_counter()
+    recent_frametimes = []
+
+    frame_start_timestamp = perf_counter()
+
+    while True and not all_games_done:
 
-    currentPop.generate_offspring()
+        if timer is not None:
+            timer.frame()
+        update_all_brains(games, brain_batch, buffers, action_repeat, timer)
 
-    currentPop.save_to_file()
-    print(currentPop.gen)
+        if timer is not None:
+            timer.switch("events")
+        for event in pygame.event.get():
+            handle_event(event, games)
+
+        if timer is not None:
+            timer.switch("physics")
+        for game in games:  # Run all games
+            game.update_physics()
+
+        if timer is not None:
+            timer.switch("collision")
+        all_games_done = True
+        for game in games:
+            game.update_collisions()
+            all_games_done = all_games_done and game.game_over
+
+        if timer is not None:
+            timer.switch("render")
+        draw_snapshots(take_snapshots(games))
+
+        if timer is not None:
+            timer.switch("sleep")
+        now = perf_counter()
+        if now - frame_start_timestamp < 1 / max_frame_rate:
+            sleep_time = 1 / max_frame_rate - (now - frame_start_timestamp)
+            sleep(sleep_time)
+
+        if timer is not None:
+            timer.switch("render")
+        frame_end_timestamp = perf_counter()
+        frametime = frame_end_timestamp - frame_start_timestamp
+        recent_frametimes.append(frametime)
+        if frame_end_timestamp - last_framerate_update >= 0.5:
+            last_framerate_update = perf_counter()
+            average_frametime = sum(recent_frametimes) / len(recent_frametimes)
+            recent_frametimes = []
+            pygame.display.set_caption("Player 1: %d                Player 2: %d              Active Game: %d                    Framerate: %f" % (games[active_game].opponents[0].score, games[active_game].opponents[1].score, active_game, 1 / average_frametime))
+
+        frame_start_timestamp = perf_counter()
+
+    if timer is not None:
+        timer.stop()
+        
+
+def init_display():
+    global pygame
+    global screen
+    global myfont
+
+    import pygame
+
+    environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % (0, 30)
+    pygame.init()
+    screen = pygame.display.set_mode((Table.length, Table.width))
+    pygame.font.init()
+    myfont = pygame.font.SysFont(Table.game_over_text_font, Table.game_over_text_size)
+    screen.fill(0)
+
+
+def calc_all_fitness(brain_pairs, results, population):
+    # results holds one Game.get_results() style dict per pair of brains, whichever backend played the game.
+    # Frame counters stop with their game, but the duration argument is that of the whole generation: the frames until
+    # its last game ended, which is what every game's frame counter used to run on to
+    generation_frames = max(result["current_frame"] for result in results)
+    duration_argument = Table.duration_argument_coeff * (Table.max_game_frames - generation_frames) / Table.max_game_frames
+    for (brain0, brain1), result in zip(brain_pairs, results):
+        brain0.hit_ball = result["hit_ball"][0]
+        brain1.hit_ball = result["hit_ball"][1]
+        brain0.scored = result["scored"][0]
+        brain1.scored = result["scored"][1]
+
+        fitness0 = brain0.fitness
+        fitness1 = brain1.fitness
+        score = result["score"]
+        own_goals = result["own_goals"]
+
+        player0_goal_argument = Table.goal_argument_coeff * (score[0] - own_goals[0] - score[1] + 2 * Table.max_score) / (3 * Table.max_score)
+        player0_duration_argument = duration_argument
+        player0_opponent_fitness_argument = Table.opponent_fitness_argument_coeff * (fitness1 / population.best_fitness)
+
+        player1_goal_argument = Table.goal_argument_coeff * (score[1] - own_goals[1] - score[0] + 2 * Table.max_score) / (3 * Table.max_score)
+        player1_duration_argument = duration_argument
+        player1_opponent_fitness_argument = Table.opponent_fitness_argument_coeff * (fitness0 / population.best_fitness)
+
+        brain0.calc_fitness([player0_goal_argument, player0_duration_argument, player0_opponent_fitness_argument])
+        brain1.calc_fitness([player1_goal_argument, player1_duration_argument, player1_opponent_fitness_argument])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evolve neural networks playing table football against each other")
+    parser.add_argument("population", nargs="?", default=None, help="population file to continue from (created if missing), "
+                        ".ckpt files are binary checkpoints and .ckptlog files keep every generation")
+    parser.add_argument("--headless", action="store_true", help="run without a window, drawing or frame rate cap")
+    parser.add_argument("--batched", action="store_true", help="evaluate all brains of a frame in one vectorized call (game backend only, the "
+                        "vector backend always does)")
+    parser.add_argument("--backend", choices=["game", "vector"], default="game",
+                        help="simulate Game objects one by one, or all games at once with numpy (headless only)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes playing the games (headless only)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the whole run (default: random)")
+    parser.add_argument("--population-size", type=int, default=None,
+                        help="number of nets per generation (default: as many as in the population file, else %d)" % Population.default_size)
+    parser.add_argument("--elites", type=int, default=Population.default_elites,
+                        help="number of best nets copied unchanged into the next generation (default: %(default)s)")
+    parser.add_argument("--activation", choices=("sigmoid", "tanh", "lookup"), default="sigmoid",
+                        help="node activation: the exact sigmoid the populations were evolved with, the same curve as "
+                        "one tanh call (faster, differs in the last bits), or a table of the sigmoid (default: %(default)s)")
+    parser.add_argument("--lookup-error", type=float, default=1e-3, metavar="ERROR",
+                        help="largest difference of --activation lookup from the sigmoid, which sets how fine its "
+                        "table is (default: %(default)s)")
+    parser.add_argument("--action-repeat", type=int, default=1, metavar="N",
+                        help="let the brains decide only every N frames, keeping their stick accelerations in between "
+                        "(default: %(default)s)")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="skip the collision checks of frames in which the ball can't touch anything, up to the next "
+                        "brain decision, moving the ball in closed form. A few percent faster (game backend, --headless or "
+                        "with --render-rate, and --action-repeat above 1 only)")
+    parser.add_argument("--render-rate", type=float, default=None, metavar="HZ",
+                        help="simulate unthrottled on a separate thread and only draw a snapshot of the games HZ times "
+                        "per second, e.g. 30 or 60 (default: draw every simulated frame, capped at %d frames/s)" % max_frame_rate)
+    parser.add_argument("--cache-games", action="store_true",
+                        help="take each game's kick-off seed from the two genomes instead of the generation, and answer "
+                        "matchups that were already played, like the elites meeting again, from a cache (headless only)")
+    parser.add_argument("--profile", default=None, metavar="FILE",
+                        help="append one JSON line per generation with the time spent in every phase of a frame and of "
+                        "the generation to FILE (frame phases are not timed with --workers)")
+    parser.add_argument("--generations", type=int, default=None, help="stop after this many generations (default: run forever)")
+    args = parser.parse_args()
+    if args.backend == "vector" and not args.headless:
+        parser.error("the vector backend can only run --headless")
+    if args.backend == "vector" and args.batched:
+        parser.error("--batched is for the game backend, the vector backend always evaluates the brains batched")
+    if args.workers > 1 and not args.headless:
+        parser.error("games can only be played by several --workers when running --headless")
+    if args.population_size is not None and (args.population_size < 2 or args.population_size % 2):
+        parser.error("--population-size has to be an even number of at least 2")
+    if args.elites < 0:
+        parser.error("--elites can't be negative")
+    if args.action_repeat < 1:
+        parser.error("--action-repeat has to be at least 1")
+    if not 0 < args.lookup_error < 1:
+        parser.error("--lookup-error has to be between 0 and 1")
+    if args.render_rate is not None and (args.headless or args.render_rate <= 0):
+        parser.error("--render-rate needs a window and a positive rate")
+    if args.fast_forward and ((not args.headless and args.render_rate is None) or args.backend != "game"):
+        parser.error("--fast-forward only works --headless or with --render-rate, with the game backend")
+    if args.cache_games and not args.headless:
+        parser.error("--cache-games only works --headless")
+
+    run_seed = args.seed if args.seed is not None else Random().getrandbits(32)
+    seed(run_seed)
+    np.random.seed(run_seed)
+    select_activation(args.activation, args.lookup_error)
+    pool = None
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=select_activation,
+                                    initargs=(args.activation, args.lookup_error))
+
+    try:
+        if not args.headless:
+            init_display()
+
+        currentPop = Population(args.population, args.population_size, args.elites)  # Load existing population or create a new one
+        # print(currentPop.all_nets)
+        currentPop.save_to_file()
+        timer = PhaseTimer() if args.profile is not None else None
+        cache = ResultCache() if args.cache_games else None
+
+        generations_run = 0
+        while args.generations is None or generations_run < args.generations:
+            gen = currentPop.gen
+            if timer is not None:
+                timer.reset()
+
+            brain_pairs = []
+            for i in range(0, len(currentPop.all_nets) - 1, 2):
+                brain_pairs.append((currentPop.all_nets[i], currentPop.all_nets[i + 1]))
+
+            start_time = perf_counter()
+            if cache is not None:
+                cache.reset_counts()
+                seeds = matchup_seeds(run_seed, brain_pairs)
+                results, frames = cache.evaluate(brain_pairs, seeds, lambda pairs, pair_seeds: evaluate_games(
+                    pairs, pair_seeds, pool, args.workers, args.backend, args.batched, args.action_repeat,
+                    args.fast_forward, timer))
+            elif args.headless:
+                seeds = game_seeds(run_seed, currentPop.gen, len(brain_pairs))
+                results, frames = evaluate_games(brain_pairs, seeds, pool, args.workers, args.backend, args.batched,
+                                                 args.action_repeat, args.fast_forward, timer)
+            else:
+                seeds = game_seeds(run_seed, currentPop.gen, len(brain_pairs))
+                games = make_games(brain_pairs, seeds)
+                if args.render_rate is not None:
+                    run_all_games_rendered(games, args.batched, args.action_repeat, args.fast_forward, args.render_rate,
+                                           timer)
+                else:
+                    run_all_games_single_window(games, args.batched, args.action_repeat, timer)
+                results = [game.get_results() for game in games]
+            elapsed = perf_counter() - start_time
+
+            if args.headless:
+                cached = ""
+                if cache is not None:
+                    cached = ", %d/%d games from cache" % (cache.hits, cache.lookups)
+                print("Generation %d: %d frames in %.2fs (%.0f frames/s)%s" % (currentPop.gen, frames, elapsed,
+                                                                              frames / elapsed if elapsed else 0, cached))
+
+            fitness_start = perf_counter()
+            calc_all_fitness(brain_pairs, results, currentPop)
+
+            selection_start = perf_counter()
+            currentPop.set_best_player()
+
+            offspring_start = perf_counter()
+            currentPop.generate_offspring()
+
+            save_start = perf_counter()
+            currentPop.save_to_file()
+            save_end = perf_counter()
+
+            if timer is not None:
+                append_jsonl(args.profile, timer.record(
+                    gen=gen, games=len(brain_pairs), cache_hits=cache.hits if cache is not None else None, game_frames=sum(result["current_frame"] for result in results),
+                    backend=args.backend if args.headless else "window" if args.render_rate is None else "rendered", batched=args.batched, workers=args.workers,
+                    generation_s={"evaluate": elapsed, "fitness": selection_start - fitness_start,
+                                  "selection": offspring_start - selection_start, "offspring": save_start - offspring_start,
+                                  "save": save_end - save_start}))
+
+            print(currentPop.gen)
+            generations_run += 1
+    finally:
+        if pool is not None:  # As leaving a with block would, also when a generation is interrupted
+            pool.terminate()
+            pool.join()
+
+
+if __name__ == "__main__":
+    main()
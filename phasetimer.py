@@ -0,0 +1,52 @@
+import json
+from time import perf_counter
+
+# Low overhead timing of where the time of a generation goes. The simulation loops call switch() with the name of the
+# phase they are entering, the time since the previous switch() is added to the phase that just ended. Loops that are
+# not given a timer (None) skip all of this, so there is no cost when profiling is off.
+#
+# Frame phases: observe (finding the brains that decide this frame and building their inputs), infer (feed forward),
+# act (applying outputs), events (pygame event polling), fast_forward (skipping frames of free ball flight), physics
+# (moving sticks and ball), collision (collisions, goals and game over checks), render (drawing and flipping the display)
+# and sleep (frame rate cap).
+
+
+class PhaseTimer:
+
+    def __init__(self):
+        self.phases = {}  # Seconds spent per phase
+        self.frames = 0  # Loop iterations, without a fast forward every running game advances one frame per iteration
+        self.phase = None
+        self.phase_start = 0
+
+    def switch(self, phase):
+        now = perf_counter()
+        if self.phase is not None:
+            self.phases[self.phase] = self.phases.get(self.phase, 0) + now - self.phase_start
+        self.phase = phase
+        self.phase_start = now
+
+    def stop(self):
+        self.switch(None)
+
+    def frame(self):
+        self.frames += 1
+
+    def reset(self):
+        self.phases = {}
+        self.frames = 0
+        self.phase = None
+
+    def record(self, **fields):
+        # Everything timed so far as one JSON serializable dict, with the mean time per frame of every phase in
+        # microseconds. fields are added as they are
+        record = dict(fields)
+        record["frames"] = self.frames
+        record["phases_s"] = dict(self.phases)
+        record["per_frame_us"] = {phase: 1e6 * seconds / self.frames for phase, seconds in self.phases.items()} if self.frames else {}
+        return record
+
+
+def append_jsonl(filename, record):
+    with open(filename, "a") as fout:
+        fout.write(json.dumps(record) + "\n")
@@ -1,9 +1,10 @@
 import json
+import re
 from time import sleep
 from datetime import datetime
 
 import pygame
-from os import environ
+from os import environ, stat
 from sys import argv
 from math import ceil
 
@@ -15,103 +16,160 @@ screen = pygame.display.set_mode((width, height))
 screen.fill(0)
 
 
-def load(old_nets):
-    try:
-        with open(argv[1], "r") as fin:
-            nets_dict = json.load(fin)
-
-            nets = nets_dict["nets"]
-    except json.decoder.JSONDecodeError:
-        nets = old_nets
+# json.dump keeps the key order of the dicts NeuralNet.Population.save_to_file builds, so every net starts with this
+net_start = re.compile(r'\{"last_layer"')
+decoder = json.JSONDecoder()
 
-    return nets
 
-
-def draw_net(num, nets):
-
-    net = nets[num]
+def index_nets(text):
+    # Offsets of the start of every net in a population file, or None while game.py is halfway through writing it.
+    # Only the last net is decoded, to make sure the file is complete
+    nets_start = text.find('"nets": [')
+    if nets_start < 0:
+        return None
+    offsets = [match.start() for match in net_start.finditer(text, nets_start)]
+    if not offsets:
+        return None
+    try:
+        last_net, end = decoder.raw_decode(text, offsets[-1])
+    except json.decoder.JSONDecodeError:
+        return None
+    if text[end:].strip() != "]}":
+        return None
+    return offsets
+
+
+class NetFile:
+    # The population file as text with an index of where each net starts in it. The file is only read again when its
+    # modification time or size changed, and of its nets only the one shown is decoded
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.version = None  # (mtime, size) of the file when it was last read completely
+        self.text = ""
+        self.offsets = []
+        self.decoded = {}  # Net number -> net dict, only for the current version
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def refresh(self):
+        # Returns whether a new version of the file was loaded
+        try:
+            file_stat = stat(self.filename)
+        except OSError:
+            return False
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+        if version == self.version:
+            return False
+
+        with open(self.filename, "r") as fin:
+            text = fin.read()
+        offsets = index_nets(text)
+        if offsets is None:  # Keep showing the old version, the write will have changed the file again once it is done
+            return False
+
+        self.version = version
+        self.text = text
+        self.offsets = offsets
+        self.decoded = {}
+        return True
+
+    def net(self, num):
+        if num not in self.decoded:
+            self.decoded = {num: decoder.raw_decode(self.text, self.offsets[num])[0]}
+        return self.decoded[num]
+
+
+# Node positions depend on nothing but the layers of the nodes, which few mutations change, so nets of a population
+# share layouts. Keyed by (last_layer, layer of every node), cleared when it grows too big
+layouts = {}
+max_layouts = 1000
+
+
+def layout(net):
+    # (x, y) of every node, the nodes of a layer spread evenly in the order of their numbers
     last_layer = net["last_layer"]
+    layers = tuple(node["layer"] for node in net["nodes"])
+    key = (last_layer, layers)
+    if key not in layouts:
+        nodes_per_layer = [0] * (last_layer + 1)
+        for layer in layers:
+            nodes_per_layer[layer] += 1
+
+        nodes_drawn = [0] * (last_layer + 1)
+        positions = []
+        for layer in layers:
+            x = int(round(((layer + 1) / (last_layer + 2)) * width))
+            y = int(round(((nodes_drawn[layer] + 1) / (nodes_per_layer[layer] + 1)) * height))
+            positions.append((x, y))
+            nodes_drawn[layer] += 1
+
+        if len(layouts) >= max_layouts:
+            layouts.clear()
+        layouts[key] = positions
+    return layouts[key]
 
-    nodes_per_layer = [0] * (last_layer + 1)
-    for node in net["nodes"]:
-        nodes_per_layer[node["layer"]] += 1
 
-    nodes_in_layer = []
-    for layer_num in range(last_layer + 1):
-        nodes_in_layer.append([])
-        for node_num in range(len(net["nodes"])):
-            if net["nodes"][node_num]["layer"] == layer_num:
-                nodes_in_layer[layer_num].append(node_num)
+def draw_net(num, nets):
 
-    nodes_drawn = [0] * (last_layer + 1)
+    net = nets.net(num)
+    positions = layout(net)
 
-    for node in net["nodes"]:
-        x = int(round(((node["layer"] + 1) / (last_layer + 2)) * width))
-        y = int(round(((nodes_drawn[node["layer"]] + 1) / ((nodes_per_layer[node["layer"]]) + 1)) * height))
-        pygame.draw.circle(screen, (255, 255, 255), (x, y), 6)
-        nodes_drawn[node["layer"]] += 1
+    for position in positions:
+        pygame.draw.circle(screen, (255, 255, 255), position, 6)
 
     for node in net["nodes"]:
         for conn_num in node["connections"]:
             connection = net["connections"][conn_num]
-            from_node = connection["from"]
-            from_layer = net["nodes"][from_node]["layer"]
-            to_node = connection["to"]
-            to_layer = net["nodes"][to_node]["layer"]
             weight = connection["weight"]
 
-            # print(nodes_per_layer)
-            # print(nodes_in_layer)
-            # print(to_layer)
-
-            x1 = int(round(((from_layer + 1) / (last_layer + 2)) * width))
-            y1 = int(round(((nodes_in_layer[from_layer].index(from_node) + 1) / (nodes_per_layer[from_layer] + 1) * height)))
-
-            x2 = int(round(((to_layer + 1) / (last_layer + 2)) * width))
-            y2 = int(round(((nodes_in_layer[to_layer].index(to_node) + 1) / (nodes_per_layer[to_layer] + 1) * height)))
-            # print(nodes_per_layer)
-            # print(from_node, nodes_in_layer[from_layer].index(from_node), to_node, nodes_in_layer[to_layer].index(to_node))
-            # print(x1, y1, x2, y2)
-
             if weight < 0.0:
-                pygame.draw.line(screen, (255, 0, 0), (x1, y1), (x2, y2), int(ceil(-weight * 8)))
+                pygame.draw.line(screen, (255, 0, 0), positions[connection["from"]], positions[connection["to"]], int(ceil(-weight * 8)))
             elif weight > 0.0:
-                pygame.draw.line(screen, (0, 255, 0), (x1, y1), (x2, y2), int(ceil(weight * 8)))
+                pygame.draw.line(screen, (0, 255, 0), positions[connection["from"]], positions[connection["to"]], int(ceil(weight * 8)))
 
     pygame.display.set_caption("View Network %d" % num)
     pygame.display.flip()
     screen.fill(0)
 
 
-nets = load([])
-draw_net(0, nets)
+nets = NetFile(argv[1])
+nets.refresh()
 
 curr_net = 0
 last_refresh = datetime.now()
+dirty = True  # Whether the window has to be drawn again: another net is shown, the file changed or the window was exposed
 
 while True:
 
     if (datetime.now() - last_refresh).total_seconds() >= 2:
-        nets = load(nets)
+        dirty = nets.refresh() or dirty
         last_refresh = datetime.now()
 
-    draw_net(curr_net, nets)
-
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             pygame.quit()
             exit(0)
 
+        if event.type == pygame.VIDEOEXPOSE:
+            dirty = True
+
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_1:
-                nets = load(nets)
+                nets.refresh()
                 curr_net -= 1
-                curr_net %= len(nets)
+                dirty = True
             elif event.key == pygame.K_3:
-                nets = load(nets)
+                nets.refresh()
                 curr_net += 1
-                curr_net %= len(nets)
+                dirty = True
             elif event.key == pygame.K_RETURN:
-                nets = load(nets)
+                dirty = nets.refresh() or dirty
+
+    if dirty and len(nets):
+        curr_net %= len(nets)
+        draw_net(curr_net, nets)
+        dirty = False
 
     sleep(0.033)
@@ -0,0 +1,32 @@
+import pickle
+from NeuralNet import Brain
+
+# Run with: python -m pytest test_brain.py
+
+
+def make_brain():
+    brain = Brain(36, 8)
+    brain.build_candidates()
+    brain.put_input([0.5] * brain.input_nodes)
+    brain.feed_forward()  # Compiles the plan
+    return brain
+
+
+def test_clone_shares_candidates():
+    brain = make_brain()
+    child = brain.clone()
+    assert brain.candidates
+    assert child.candidates is brain.candidates
+    assert child.candidate_index is brain.candidate_index
+    assert child.plan is None and brain.plan is not None
+
+
+def test_pickled_brain_drops_candidates_and_plan():
+    brain = make_brain()
+    copy = pickle.loads(pickle.dumps(brain))
+    assert copy.candidates is None and copy.candidate_index is None
+    assert copy.plan is None and copy.node_values == []
+    assert brain.candidates and brain.plan is not None  # The pickled brain itself is left alone
+    copy.put_input([0.5] * copy.input_nodes)
+    copy.feed_forward()
+    assert copy.get_outputs() == brain.get_outputs()
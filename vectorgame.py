@@ -0,0 +1,343 @@
+from math import pi
+from random import Random
+import numpy as np
+from NeuralNet import BrainBatch
+from game import Table, PlayerStick, stick_reach
+
+
+class VectorGames:
+    # Struct-of-arrays version of a list of Game objects. Ball state is stored in (games,) arrays and stick state in
+    # (games, opponents, sticks) arrays, so one call to update_all() advances every game by one frame with the same
+    # rules, constants and order of operations as Game.update_all()
+
+    def __init__(self, seeds):
+        game_count = len(seeds)
+        self.game_count = game_count
+        self.randoms = [Random(seed) for seed in seeds]  # Same per game generators as Game
+
+        # Fixed stick properties, taken from PlayerStick so both backends share a single definition
+        sticks = [[PlayerStick(opponent_num, role, None) for role in range(4)] for opponent_num in range(2)]
+        self.stick_pos_x = np.array([[stick.pos_x for stick in row] for row in sticks])
+        self.stick_lin_range = np.array([[stick.lin_range for stick in row] for row in sticks], dtype=float)
+        self.stick_players = [[stick.players for stick in row] for row in sticks]
+
+        stick_shape = (game_count, 2, 4)
+        self.lin_acc = np.zeros(stick_shape)
+        self.lin_vel = np.zeros(stick_shape)
+        self.lin_pos = np.zeros(stick_shape)
+        self.rot_acc = np.zeros(stick_shape)
+        self.rot_vel = np.zeros(stick_shape)
+        self.rot_pos = np.zeros(stick_shape)
+
+        self.ball_pos_x = np.full(game_count, float(int(round(Table.length / 2))))
+        self.ball_pos_y = np.full(game_count, float(int(round(Table.width / 2))))
+        self.ball_vel_x = np.zeros(game_count)
+        self.ball_vel_y = np.zeros(game_count)
+        for i in range(game_count):
+            self.ball_vel_x[i] = self.randoms[i].uniform(-0.2, 0.2) * Table.ball_max_vel
+            self.ball_vel_y[i] = self.randoms[i].uniform(-0.2, 0.2) * Table.ball_max_vel
+        self.last_player_touched = np.full(game_count, -1)  # -1 means nobody touched the ball yet
+
+        self.score = np.zeros((game_count, 2), dtype=int)
+        self.own_goals = np.zeros((game_count, 2), dtype=int)
+        self.hit_ball = np.zeros((game_count, 2), dtype=bool)
+        self.scored = np.zeros((game_count, 2), dtype=bool)
+
+        self.current_frame = np.zeros(game_count, dtype=int)
+        self.last_goal_frame = np.zeros(game_count, dtype=int)
+        self.game_over = np.zeros(game_count, dtype=bool)
+
+        # Observation column order of Game.fill_inputs(): 4 values for each own stick, then for each enemy stick
+        self.observations = np.zeros((2 * game_count, 36))
+
+    def get_inputs(self):
+        # Observations of all brains as a (2 * games x 36) array, rows 2i and 2i + 1 are the two players of game i
+        stick_inputs = np.stack((self.lin_pos / self.stick_lin_range, self.lin_vel / Table.player_max_lin_vel,
+                                 self.rot_pos / pi, self.rot_vel / Table.player_max_rot_vel), axis=-1)
+        stick_inputs = stick_inputs.reshape(self.game_count, 2, 16)
+
+        observations = self.observations.reshape(self.game_count, 2, 36)
+        observations[:, 0, 0:16] = stick_inputs[:, 0]
+        observations[:, 0, 16:32] = stick_inputs[:, 1]
+        observations[:, 1, 0:16] = stick_inputs[:, 1]
+        observations[:, 1, 16:32] = stick_inputs[:, 0]
+        for opponent_num, direction in ((0, 1), (1, -1)):
+            observations[:, opponent_num, 32] = direction * (self.ball_pos_x - Table.length / 2) / (Table.length / 2)
+            observations[:, opponent_num, 33] = direction * self.ball_vel_x / Table.ball_max_vel
+            observations[:, opponent_num, 34] = (self.ball_pos_y - Table.width / 2) / (Table.width / 2)
+            observations[:, opponent_num, 35] = self.ball_vel_y / Table.ball_max_vel
+        return self.observations
+
+    def apply_outputs(self, outputs):
+        # outputs is the (2 * games x 8) array of brain outputs, in the same row order as get_inputs()
+        outputs = outputs.reshape(self.game_count, 2, 4, 2)
+        running = ~self.game_over
+        self.lin_acc[running] = outputs[running, :, :, 0] * Table.key_lin_acc
+        self.rot_acc[running] = outputs[running, :, :, 1] * Table.key_rot_acc
+
+    def update_sticks(self, running):
+        lin_vel = np.clip(self.lin_vel + self.lin_acc, -Table.player_max_lin_vel, Table.player_max_lin_vel)
+        lin_pos = np.clip(np.round(self.lin_pos + lin_vel), -self.stick_lin_range, self.stick_lin_range)
+        rot_vel = np.clip(self.rot_vel + self.rot_acc, -Table.player_max_rot_vel, Table.player_max_rot_vel)
+        rot_pos = self.rot_pos + rot_vel
+
+        # Same two loops as mod2pi(), applied element-wise
+        while True:
+            below = rot_pos < pi
+            if not below.any():
+                break
+            rot_pos[below] += 2 * pi
+        while True:
+            above = rot_pos > pi
+            if not above.any():
+                break
+            rot_pos[above] -= 2 * pi
+
+        self.lin_vel[running] = lin_vel[running]
+        self.lin_pos[running] = lin_pos[running]
+        self.rot_vel[running] = rot_vel[running]
+        self.rot_pos[running] = rot_pos[running]
+
+    def update_ball(self, running):
+        vel_x = np.clip(self.ball_vel_x, -Table.ball_max_vel, Table.ball_max_vel)
+        vel_y = np.clip(self.ball_vel_y, -Table.ball_max_vel, Table.ball_max_vel)
+
+        # Account for friction
+        vel_x = vel_x - Table.ball_table_friction_coefficient * (vel_x ** 2)
+        vel_y = vel_y - Table.ball_table_friction_coefficient * (vel_y ** 2)
+
+        self.ball_vel_x = np.where(running, vel_x, self.ball_vel_x)
+        self.ball_vel_y = np.where(running, vel_y, self.ball_vel_y)
+        self.ball_pos_x = np.where(running, self.ball_pos_x + vel_x, self.ball_pos_x)
+        self.ball_pos_y = np.where(running, self.ball_pos_y + vel_y, self.ball_pos_y)
+
+    def check_collision(self, running):
+        half_thickness = Table.player_thickness / 2
+        half_width = Table.player_width / 2
+        radius = Table.ball_radius
+        efficiency = Table.player_hit_cin_energy_efficiency
+
+        # Boxes are handled one at a time in the same order as Ball.check_collision walks the sticks, since each
+        # collision moves the ball before the next box is tested
+        for opponent_num in range(2):
+            for role in range(4):
+                stick_pos_x = self.stick_pos_x[opponent_num, role]
+                rot_pos = self.rot_pos[:, opponent_num, role]
+                stick_active = running & (np.abs(rot_pos) < Table.player_angle_hit_limit)
+                if not (stick_active & (np.abs(self.ball_pos_x - stick_pos_x) <= stick_reach)).any():
+                    continue
+
+                center_x = stick_pos_x + Table.player_height / 2 * np.sin(rot_pos)
+                rot_speed = self.rot_vel[:, opponent_num, role] * Table.player_height
+                lin_speed = self.lin_vel[:, opponent_num, role]
+                players = self.stick_players[opponent_num][role]
+
+                for i in range(players):
+                    center_y = ((i + 1) / (players + 1)) * Table.width + self.lin_pos[:, opponent_num, role]
+                    self.collide_box(stick_active, opponent_num, center_x, center_y, rot_speed, lin_speed,
+                                     half_thickness, half_width, radius, efficiency)
+
+        self.check_edges(running)
+
+    def collide_box(self, active, opponent_num, center_x, center_y, rot_speed, lin_speed, half_thickness, half_width,
+                    radius, efficiency):
+        # Only games whose ball overlaps the box grown by the ball radius can collide with it, all branches below
+        # are evaluated on just those games and scattered back
+        near = active & (np.abs(self.ball_pos_x - center_x) <= half_thickness + radius)
+        near &= np.abs(self.ball_pos_y - center_y) <= half_width + radius
+        games = np.flatnonzero(near)
+        if not len(games):
+            return
+
+        pos_x = self.ball_pos_x[games]
+        pos_y = self.ball_pos_y[games]
+        vel_x = self.ball_vel_x[games]
+        vel_y = self.ball_vel_y[games]
+        rot_speed = rot_speed[games]
+        lin_speed = lin_speed[games]
+        left = center_x[games] - half_thickness
+        right = center_x[games] + half_thickness
+        top = center_y[games] - half_width
+        bottom = center_y[games] + half_width
+
+        new_pos_x = pos_x.copy()
+        new_pos_y = pos_y.copy()
+        new_vel_x = vel_x.copy()
+        new_vel_y = vel_y.copy()
+
+        # The branches are mutually exclusive, like the if/elif chain in Ball.check_collision
+        in_height = (top <= pos_y) & (pos_y <= bottom)
+        in_width = ~in_height & (left <= pos_x) & (pos_x <= right)
+        corner_candidate = ~in_height & ~in_width
+
+        hit = in_height & (pos_x + radius >= left) & (pos_x - radius <= right)  # Ball hit a side of the hitbox
+        new_pos_x = np.where(hit & (vel_x < rot_speed), right + radius + 1, new_pos_x)
+        new_pos_x = np.where(hit & (vel_x > rot_speed), left - radius - 1, new_pos_x)
+        new_vel_x = np.where(hit, (- vel_x) * efficiency + rot_speed, new_vel_x)
+        new_vel_y = np.where(hit, vel_y * efficiency, new_vel_y)
+        any_hit = hit
+
+        hit = in_width & (pos_y + radius >= top) & (pos_y - radius <= bottom)  # Ball hit upper or lower side
+        new_pos_y = np.where(hit & (vel_y < lin_speed), bottom + radius + 1, new_pos_y)
+        new_pos_y = np.where(hit & (vel_y > lin_speed), top - radius - 1, new_pos_y)
+        new_vel_x = np.where(hit, vel_x * efficiency, new_vel_x)
+        new_vel_y = np.where(hit, (- vel_y) * efficiency + lin_speed, new_vel_y)
+        any_hit = any_hit | hit
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            remaining = corner_candidate
+            for corner_x, corner_y, is_left, is_top in ((left, top, True, True), (left, bottom, True, False),
+                                                        (right, top, False, True), (right, bottom, False, False)):
+                in_corner = remaining & ((pos_x <= corner_x) if is_left else (pos_x >= corner_x))
+                in_corner = in_corner & ((pos_y <= corner_y) if is_top else (pos_y >= corner_y))
+                remaining = remaining & ~in_corner
+
+                hit = in_corner & (np.sqrt((corner_x - pos_x) ** 2 + (corner_y - pos_y) ** 2) <= radius)
+                if not hit.any():
+                    continue
+
+                x = pos_x - corner_x
+                y = pos_y - corner_y
+                c = - 2 * (vel_x * x + vel_y * y) / (x ** 2 + y ** 2)
+                new_vel_x = np.where(hit, (vel_x + c * x) * efficiency + rot_speed, new_vel_x)
+                new_vel_y = np.where(hit, (vel_y + c * y) * efficiency + lin_speed, new_vel_y)
+
+                if is_left:
+                    tan_a = ((corner_y - pos_y) if is_top else (pos_y - corner_y)) / (corner_x - pos_x)
+                    corner_pos_x = corner_x - (radius + 1) / (np.sqrt(1 + tan_a ** 2))
+                else:
+                    tan_a = ((corner_y - pos_y) if is_top else (pos_y - corner_y)) / (pos_x - corner_x)
+                    corner_pos_x = + corner_x + (radius + 1) / (np.sqrt(1 + tan_a ** 2))
+                if is_left == is_top:
+                    corner_pos_y = (corner_pos_x - corner_x) * tan_a + corner_y
+                else:
+                    corner_pos_y = (corner_x - corner_pos_x) * tan_a + corner_y
+                new_pos_x = np.where(hit, corner_pos_x, new_pos_x)
+                new_pos_y = np.where(hit, corner_pos_y, new_pos_y)
+                any_hit = any_hit | hit
+
+        self.ball_pos_x[games] = new_pos_x
+        self.ball_pos_y[games] = new_pos_y
+        self.ball_vel_x[games] = new_vel_x
+        self.ball_vel_y[games] = new_vel_y
+        self.hit_ball[games[any_hit], opponent_num] = True
+        self.last_player_touched[games[any_hit]] = opponent_num
+
+    def check_edges(self, running):
+        radius = Table.ball_radius
+        efficiency = Table.edge_hit_cin_energy_efficiency
+        goal_top = Table.width / 2 - Table.goal_width / 2
+        goal_bottom = Table.width / 2 + Table.goal_width / 2
+        goals = np.zeros(self.game_count, dtype=bool)
+
+        for side in range(2):  # Left edge first, then right edge, as in Ball.check_collision
+            if side == 0:
+                hit = running & (self.ball_pos_x - radius <= 0)
+                self.ball_pos_x[hit] = radius + 1
+            else:
+                hit = running & (self.ball_pos_x + radius >= Table.length)
+                self.ball_pos_x[hit] = Table.length - radius - 1
+            self.ball_vel_x[hit] = (- self.ball_vel_x[hit]) * efficiency
+            self.ball_vel_y[hit] = self.ball_vel_y[hit] * efficiency
+
+            if side == 0:
+                goal = hit & (self.ball_pos_y >= goal_top) & (self.ball_pos_y <= goal_bottom)
+            else:
+                goal = hit & (self.ball_pos_y - radius >= goal_top) & (self.ball_pos_y + radius <= goal_bottom)
+            scorer = 1 - side  # A goal in the left goal counts for player 2 and vice versa
+            self.score[goal, scorer] += 1
+            own_goal = goal & (self.last_player_touched == side)
+            self.own_goals[own_goal, side] += 1
+            self.scored[goal & ~own_goal, scorer] = True
+            self.last_goal_frame[goal] = self.current_frame[goal]
+            for stick_state in (self.lin_pos, self.lin_vel, self.lin_acc, self.rot_pos, self.rot_vel, self.rot_acc):
+                stick_state[goal] = 0
+            self.ball_pos_x[goal] = Table.length / 2
+            self.ball_pos_y[goal] = Table.width / 2
+            goals |= goal
+
+        for i in np.flatnonzero(goals):  # Kick off again
+            self.ball_vel_x[i] = self.randoms[i].uniform(-0.2, 0.2) * Table.ball_max_vel
+            self.ball_vel_y[i] = self.randoms[i].uniform(-0.2, 0.2) * Table.ball_max_vel
+
+        hit = running & (self.ball_pos_y - radius <= 0)  # Upper edge collision
+        self.ball_pos_y[hit] = radius + 1
+        self.ball_vel_x[hit] = self.ball_vel_x[hit] * efficiency
+        self.ball_vel_y[hit] = (- self.ball_vel_y[hit]) * efficiency
+
+        hit = running & (self.ball_pos_y + radius >= Table.width)  # Lower edge collision
+        self.ball_pos_y[hit] = Table.width - radius - 1
+        self.ball_vel_x[hit] = self.ball_vel_x[hit] * efficiency
+        self.ball_vel_y[hit] = (- self.ball_vel_y[hit]) * efficiency
+
+    def update_all(self):
+        self.update_physics()
+        self.update_collisions()
+
+    def update_physics(self):
+        running = ~self.game_over
+        self.current_frame += running  # Frame counters stop with their game, as in Game.update_all
+
+        self.update_sticks(running)
+        self.update_ball(running)
+
+    def update_collisions(self):
+        running = ~self.game_over
+        self.check_collision(running)
+
+        self.game_over |= running & (self.score.max(axis=1) >= Table.max_score)
+        self.game_over |= running & (self.current_frame - self.last_goal_frame >= Table.max_frames_no_goals)
+        self.game_over |= running & (self.current_frame >= Table.max_game_frames)
+
+    def get_results(self):
+        # One Game.get_results() style dict per game
+        results = []
+        for i in range(self.game_count):
+            results.append({"score": (int(self.score[i, 0]), int(self.score[i, 1])),
+                            "own_goals": (int(self.own_goals[i, 0]), int(self.own_goals[i, 1])),
+                            "current_frame": int(self.current_frame[i]),
+                            "hit_ball": (bool(self.hit_ball[i, 0]), bool(self.hit_ball[i, 1])),
+                            "scored": (bool(self.scored[i, 0]), bool(self.scored[i, 1]))})
+        return results
+
+
+def run_vector_games(brain_pairs, seeds, action_repeat=1, timer=None):
+    # Play one game per pair of brains with the vectorized backend, returns the results and the simulated game frames
+    # The brains decide every action_repeat frames, timer optionally is a PhaseTimer that the phases of every frame
+    # are timed with. All games advance in lockstep, so step is the current frame of every game still running
+    brains = []
+    for brain0, brain1 in brain_pairs:
+        brains.append(brain0)
+        brains.append(brain1)
+    brain_batch = BrainBatch(brains)
+    games = VectorGames(seeds)
+
+    frames = 0
+    step = 0
+    while not games.game_over.all():
+        deciding = step % action_repeat == 0
+        step += 1
+        if timer is None:
+            if deciding:
+                games.apply_outputs(brain_batch.feed_forward(games.get_inputs()))
+            frames += int(np.count_nonzero(~games.game_over))
+            games.update_all()
+            continue
+
+        timer.frame()
+        if deciding:
+            timer.switch("observe")
+            inputs = games.get_inputs()
+            timer.switch("infer")
+            outputs = brain_batch.feed_forward(inputs)
+            timer.switch("act")
+            games.apply_outputs(outputs)
+        frames += int(np.count_nonzero(~games.game_over))
+        timer.switch("physics")
+        games.update_physics()
+        timer.switch("collision")
+        games.update_collisions()
+
+    if timer is not None:
+        timer.stop()
+    return games.get_results(), frames